@@ -35,6 +35,52 @@
 # In the Python shell, ds.Models shows unique data only. 
 # The UFED PA GUI shows duplicate counts (in parenthesis).
 
+# changelog 2026-10-19  Removed items are journaled at the position known from their verdict instead of searching the collection
+# changelog 2026-10-19  Deleted Data Files kept by doNotDateFilterDeleted are not read for EXIF or container timestamps
+# changelog 2026-10-19  A bad batch case is reported without stopping the batch, a failed run closes its log and audit
+# changelog 2026-10-19  bench_accessors() times timestamp field reads, useCachedAccessors reads them through accessors cached per model type
+# changelog 2026-10-19  The previous snapshot is found regardless of the sanity check, chat envelope and attachment options
+# changelog 2026-10-19  Checkpoints are checked against the key digests of their verdicts and of the last item done
+# changelog 2026-10-19  Cached verdicts are checked against a digest of each item's key, a moved item invalidates the cache
+# changelog 2026-10-19  The chat envelope only keeps messages whose TimeStamp lies within it
+# changelog 2026-10-19  MetaData DateTime with fractional seconds or 'Z' before the UTC offset, other forms parsed by .NET
+# changelog 2026-10-19  A timestamp policy file without the layout of the default policy is ignored, with a log message
+# changelog 2026-10-19  Deleted Data Files kept by doNotDateFilterDeleted have their timestamps in the snapshot
+# changelog 2026-10-19  Previous snapshots are only reused with the same exifFallback and containerTimestamps
+# changelog 2026-10-19  EXIF headers are read one at a time by default and cached by path
+# changelog 2026-10-19  Cached and resumed runs copy the audit records of the run that classified their items, or mark the audit partial
+# changelog 2026-10-19  Messages kept by their chat envelope get the same identity as when they are checked one by one
+# changelog 2026-10-19  Item identities include the model's source file and offset and an ordinal among items with the same key
+# changelog 2026-10-19  Preview never writes checkpoints; a failed run stops checkpointing
+# changelog 2026-10-19  Previous snapshot spans are only used for the same datastore fingerprint and are not carried into the new snapshot
+# changelog 2026-10-19  Batch cases against a datastore that was already filtered are skipped
+# changelog 2026-10-19  Attachments are matched to Data Files by path, never by file name alone, and not when the path matches several files
+# changelog 2026-10-19  Creation and modification times of MP4/MOV/M4A/3GP Data Files read from their mvhd box
+# changelog 2026-10-19  EXIF capture time read from the file header of images without MetaData
+# changelog 2026-10-19  run_oracle() compares the legacy filter_AnalyzedData() verdicts with filter_AnalyzedData2() item by item
+# changelog 2026-10-19  Removal and undo change each collection in one bulk update where PA supports it
+# changelog 2026-10-19  Preview: timestamps per category in a proposed range from an hour bucket timeline
+# changelog 2026-10-19  Undo last filter: removed items are restored from a journal of the last run
+# changelog 2026-10-19  Attachments are kept with the kept items that reference them, files only attached to removed items go with them
+# changelog 2026-10-19  IMs of chats within the date range (StartTime to LastActivity) are kept without checking each one
+# changelog 2026-10-19  AllTimeStamps evaluated in one pass up to the first entry within range, one log line per item
+# changelog 2026-10-19  sanityCheckTimestamps: implausible timestamps are treated as None, counted per category
+# changelog 2026-10-19  deviceTimeZone: local EXIF and DeviceInfo times converted to UTC with a DST transition table
+# changelog 2026-10-19  Stable item identities in the audit and the removal manifest
+# changelog 2026-10-19  Hash chained manifest of removed items, root hash shown at the end
+# changelog 2026-10-19  JSONL audit of every kept and removed item with the deciding field and rule
+# changelog 2026-10-19  Log is written in size capped segments, finished segments are gzipped, with a category index
+# changelog 2026-10-19  Checkpoints every minute, an interrupted run resumes from its checkpoint
+# changelog 2026-10-19  Verdicts are cached per datastore fingerprint, re-runs go straight to removal
+# changelog 2026-10-19  Batch mode: filter the cases of a JSON manifest with one consolidated report
+# changelog 2026-10-19  DeviceInfo timestamps parsed with a precompiled pattern straight to ticks.
+#						DeviceInfo entries without a timestamp are kept.
+# changelog 2026-10-19  One Data Files filter for PA 5.3 and 5.4+ through a version adapter probed once
+# changelog 2026-10-19  Timestamp fields per model type come from a policy table, optionally PA_date_filter_policy.json
+# changelog 2026-10-19  Cache model type and category names once per run
+# changelog 2026-10-19  Keep or remove whole categories that were entirely inside or outside the date range
+#						in the previous snapshot of the device
+# changelog 2026-10-19  Write evaluated timestamps to a snapshot in Logs for PA_date_filter_offline.py
 # changelog 2019-02-21  Added a little bit more robust date recognizing and handling for EXIFCaptureTime 
 #						Added support for time.strptime
 # changelog 2017-12-18  Skip all category types of Data.Models.ContactModels.Contact
@@ -56,11 +102,20 @@ from physical import *
 
 from datetime import datetime
 import time
+import os
 import re
+import struct
+import json
+import hashlib
+import threading
+import bisect
+import operator
+from array import array
 import clr
 clr.AddReference ('System.Windows.Forms')
 from System.Windows.Forms import MessageBox, Application, Button, Form, \
-									Label, TextBox, CheckBox
+									Label, TextBox, CheckBox, OpenFileDialog, DialogResult, \
+									MessageBoxButtons
 from System.Drawing import Point
 
 
@@ -79,6 +134,15 @@ doNotDateFilterDeleted = True
 # Default is to not filter by LastContacted
 doNotFilterContact_by_LastContacted = True
 
+# Time zone of the device, for timestamps stored as local time without an
+# offset (EXIF capture times, DeviceInfo values without 'UTC').
+# None: the time zone of the PA computer (as System.Convert.ToDateTime does)
+# and DeviceInfo values without 'UTC' are treated as UTC.
+# "-7", "+05:30": a fixed UTC offset.
+# Otherwise a Windows time zone id such as "Pacific Standard Time", with its
+# daylight saving time transitions.
+deviceTimeZone = None
+
 # date ranges using tz offset -7 or -8 for PST or PDT
 date_start = "2018-08-20 00:00:00-7"
 date_end = "2019-02-20 23:59:59-8"
@@ -97,6 +161,42 @@ log = ''
 # used to track current file for debugging purposes
 currentFile = ''
 
+# Write every evaluated timestamp to a binary snapshot in the 'Logs' folder
+# so the case can be re-classified off the PA workstation with
+# PA_date_filter_offline.py
+writeTimestampSnapshot = True
+snapshot = None
+snapshot_categories = []
+snapshot_category_ids = {}
+snapshot_category = 0
+snapshot_item_num = 0
+snapshot_item_ticks = None
+snapshot_spans = {}
+snapshot_carried = []
+snapshot_samples = {}
+# category: number of items kept without evaluating their timestamps
+snapshot_skipped = {}
+snapshot_device = ''
+# datastore_fingerprint() without the date range, written to the snapshot's .json
+snapshot_fingerprint = None
+
+# A category whose whole timestamp span in the previous snapshot of the same
+# datastore is inside (or outside) the date range is kept (or removed)
+# without evaluating each item. Deleted items and items without timestamps
+# are still kept as usual. The previous snapshot must have the same
+# snapshot_fingerprint: same device, item counts, DeviceInfo, timestamp
+# policy and every option that decides which timestamps are read.
+# A category decided this way has no records and no span in the new
+# snapshot (it is listed as 'carried'), so the run after it measures the
+# category again instead of reusing a span that was never re-measured.
+usePreviousSnapshot = True
+previous_spans = {}
+previous_quartiles = {}
+start_ticks = None
+end_ticks = None
+SPAN_INSIDE = 'inside'
+SPAN_OUTSIDE = 'outside'
+
 # IronPython 2.6 missing datetime.strptime 
 if hasattr(datetime, 'strptime'):
     #python 2.6
@@ -105,10 +205,21 @@ else:
     #python 2.4 equivalent
     strptime = lambda date_string, format: datetime(*(time.strptime(date_string, format)[0:6]))
 
+# EXIF date format that parsed last. A device uses one format so it is tried first.
+exif_date_format = None
+
 def try_strptime(s, fmts=['%d-%b-%y','%m/%d/%Y','%Y-%m-%d','%Y/%m/%d']):
+    global exif_date_format
+    if exif_date_format is not None:
+        try:
+            return strptime(s, exif_date_format)
+        except ValueError as ve:
+            pass
     for fmt in fmts:
         try:
-            return strptime(s, fmt)
+            d = strptime(s, fmt)
+            exif_date_format = fmt
+            return d
         except ValueError as ve:
             print("ValueError Raised:", ve)
     return None
@@ -122,21 +233,1622 @@ def debug(string, errtype):
 		print (errtype, e)
 
 
+# Log split into segments of about logSegmentBytes.
+# The first segment is the log filename, the next ones are
+# <log>.002.txt, <log>.003.txt, ... Finished segments are gzipped by a
+# background thread when gzip is available. <log>.index.json lists the
+# segments and the categories logged in each, so a category can be found
+# without decompressing the whole log.
+logSegmentBytes = 64*1024*1024
+compressLogSegments = True
+LOG_BUFFER_BYTES = 1024*1024
+
+try:
+	import gzip
+except ImportError:
+	gzip = None
+
+def compress_log_segment(filename):
+	try:
+		src = open(filename, 'rb')
+		dst = gzip.open(filename+'.gz', 'wb')
+		try:
+			while True:
+				data = src.read(LOG_BUFFER_BYTES)
+				if not data:
+					break
+				dst.write(data)
+		finally:
+			dst.close()
+			src.close()
+		os.remove(filename)
+	except Exception as e:
+		print("Unable to compress log segment "+filename+": "+str(e))
+
+
+class SegmentedLog(object):
+	def __init__(self, filename):
+		self.filename = filename
+		self.index_filename = filename[:-4]+".index.json"
+		self.segments = []
+		self.category = None
+		self.threads = []
+		self.out = None
+		self.open_segment()
+
+	def open_segment(self):
+		n = len(self.segments)+1
+		if n == 1:
+			name = self.filename
+		else:
+			name = self.filename[:-4]+".%03d.txt" % n
+		self.out = open(name, 'w', LOG_BUFFER_BYTES)
+		self.size = 0
+		categories = []
+		if self.category is not None:
+			categories.append(self.category)
+		self.segments.append({'file': os.path.basename(name), 'categories': categories})
+
+	def close_segment(self):
+		self.out.close()
+		self.out = None
+		segment = self.segments[-1]
+		segment['bytes'] = self.size
+		if compressLogSegments is True and gzip is not None:
+			segment['file'] += '.gz'
+			t = threading.Thread(target=compress_log_segment,
+				args=(os.path.join(os.path.dirname(self.filename), segment['file'][:-3]),))
+			t.start()
+			self.threads.append(t)
+
+	# Following writes belong to category 'name'
+	def set_category(self, name):
+		self.category = str(name)
+		categories = self.segments[-1]['categories']
+		if self.category not in categories:
+			categories.append(self.category)
+
+	def write(self, s):
+		if self.size >= logSegmentBytes:
+			self.close_segment()
+			self.write_index()
+			self.open_segment()
+		self.out.write(s)
+		self.size += len(s)
+
+	def write_index(self):
+		index = open(self.index_filename, 'w')
+		try:
+			json.dump({'log': os.path.basename(self.filename), 'segments': self.segments}, index, indent=1)
+		finally:
+			index.close()
+
+	# The last segment is left uncompressed
+	def close(self):
+		self.out.close()
+		self.segments[-1]['bytes'] = self.size
+		for t in self.threads:
+			t.join()
+		self.write_index()
+
+
+# Timestamp snapshot
+# Header is SNAPSHOT_MAGIC followed by fixed width little-endian records:
+#   item number (uint32), category id (uint16), flags (uint8), pad, ticks (int64)
+# Records are written in item number order. An item without any
+# timestamps gets a single record flagged SNAPSHOT_NONE.
+# Category names, [min ticks, max ticks, items] spans per category and
+# the run options are written to <snapshot>.json
+SNAPSHOT_MAGIC = 'PADFSNP1'
+SNAPSHOT_RECORD = struct.Struct('<IHBxq')
+SNAPSHOT_DELETED = 1
+SNAPSHOT_NONE = 2
+
+DOTNET_EPOCH = datetime(1, 1, 1)
+TICKS_PER_SECOND = 10000000
+
+def toTicks(timestamp):
+	''' UTC .NET ticks of a PA TimeStamp. None if it cannot be converted.
+	'''
+	try:
+		return timestamp.Value.ToUniversalTime().Ticks
+	except Exception:
+		return None
+
+
+def ticksFromString(s, utc_offset=0):
+	''' UTC .NET ticks of 'yyyy-mm-dd hh:mm:ss' at utc_offset hours, without
+	System.Convert.ToDateTime. None if it is not a valid date.
+	'''
+	try:
+		d = datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19])) - DOTNET_EPOCH
+	except ValueError:
+		return None
+	return (d.days*86400 + d.seconds - utc_offset*3600)*TICKS_PER_SECOND
+
+
+# Timezone normalization
+# Local timestamps are converted to UTC ticks with a table of the UTC offset
+# transitions of a time zone between TIMEZONE_FIRST_YEAR and
+# TIMEZONE_LAST_YEAR. The table is built once per time zone from
+# System.TimeZoneInfo, after that a conversion is a bisect of the table.
+# Local times that occur twice when DST ends are taken as standard time,
+# like System.Convert.ToDateTime does.
+TIMEZONE_FIRST_YEAR = 1970
+TIMEZONE_LAST_YEAR = 2040
+TICKS_PER_MINUTE = 60*TICKS_PER_SECOND
+TICKS_PER_DAY = 86400*TICKS_PER_SECOND
+UTC_OFFSET = re.compile(r'^\s*(?:UTC|GMT)?\s*([+-])(\d{1,2})(?::?(\d\d))?\s*$')
+# fractional seconds between the seconds and the UTC offset of a MetaData time
+FRACTIONAL_SECONDS = re.compile(r'^\.\d+')
+
+# time zone name: ([local ticks where an offset starts], [offset ticks])
+timezone_tables = {}
+
+# Local .NET ticks of a date and time. Raises ValueError if it is not a valid date.
+def civilTicks(yyyy, mm, dd, hr, mn, sec):
+	d = datetime(yyyy, mm, dd, hr, mn, sec) - DOTNET_EPOCH
+	return (d.days*86400 + d.seconds)*TICKS_PER_SECOND
+
+
+# Ticks of a UTC offset like '-7', '+0530' or '-07:00'. None if it is not one.
+def offsetTicks(s):
+	m = UTC_OFFSET.match(s)
+	if m is None:
+		return None
+	sign, hours, minutes = m.groups()
+	ticks = (int(hours)*60 + int(minutes or 0))*TICKS_PER_MINUTE
+	if sign == '-':
+		return -ticks
+	return ticks
+
+
+def build_transition_table(tz):
+	def offset_at(ticks):
+		return tz.GetUtcOffset(System.DateTime(ticks, System.DateTimeKind.Utc)).Ticks
+	t = civilTicks(TIMEZONE_FIRST_YEAR, 1, 1, 0, 0, 0)
+	end = civilTicks(TIMEZONE_LAST_YEAR+1, 1, 1, 0, 0, 0)
+	offset = offset_at(t)
+	starts = [0]
+	offsets = [offset]
+	while t < end:
+		next_t = t + TICKS_PER_DAY
+		next_offset = offset_at(next_t)
+		if next_offset != offset:
+			# transitions are on whole minutes
+			lo = t
+			hi = next_t
+			while hi - lo > TICKS_PER_MINUTE:
+				mid = lo + (hi - lo)//TICKS_PER_MINUTE//2*TICKS_PER_MINUTE
+				if offset_at(mid) == offset:
+					lo = mid
+				else:
+					hi = mid
+			starts.append(hi + next_offset)
+			offsets.append(next_offset)
+			offset = next_offset
+		t = next_t
+	return starts, offsets
+
+
+def timezone_table(name):
+	table = timezone_tables.get(name)
+	if table is None:
+		offset = None
+		if name is not None:
+			offset = offsetTicks(name)
+		if offset is not None:
+			table = ([0], [offset])
+		elif name is None:
+			table = build_transition_table(System.TimeZoneInfo.Local)
+		else:
+			table = build_transition_table(System.TimeZoneInfo.FindSystemTimeZoneById(name))
+		timezone_tables[name] = table
+	return table
+
+
+def localToUtcTicks(local_ticks):
+	starts, offsets = timezone_table(deviceTimeZone)
+	i = bisect.bisect_right(starts, local_ticks) - 1
+	return local_ticks - offsets[max(i, 0)]
+
+
+# UTC ticks of a date and time, local to the device unless offset (ticks) is given
+def normalizeTicks(yyyy, mm, dd, hr, mn, sec, offset=None):
+	ticks = civilTicks(yyyy, mm, dd, hr, mn, sec)
+	if offset is None:
+		return localToUtcTicks(ticks)
+	return ticks - offset
+
+
+def snapshot_open(filename):
+	global snapshot
+	global snapshot_categories
+	global snapshot_category_ids
+	global snapshot_item_num
+	global snapshot_item_ticks
+	global snapshot_spans
+	global snapshot_carried
+	global snapshot_samples
+	global snapshot_skipped
+
+	snapshot_categories = []
+	snapshot_samples = {}
+	snapshot_skipped = {}
+	snapshot_category_ids = {}
+	snapshot_item_num = 0
+	snapshot_item_ticks = None
+	snapshot_spans = {}
+	snapshot_carried = []
+	try:
+		snapshot = open(filename, 'wb')
+		snapshot.write(SNAPSHOT_MAGIC)
+	except Exception as e:
+		snapshot = None
+		msg = "Unable to write timestamp snapshot "+filename+": "+str(e)
+		print(msg)
+		debug(msg, 'snapshot open error writing log')
+
+
+# Following records belong to category 'name'
+def snapshot_set_category(name):
+	global snapshot_category
+	if snapshot is None:
+		return
+	name = str(name)
+	if name not in snapshot_category_ids:
+		snapshot_category_ids[name] = len(snapshot_categories)
+		snapshot_categories.append(name)
+		snapshot_spans[name] = [None, None, 0]
+		# [stride, countdown, ticks]
+		snapshot_samples[name] = [1, 1, []]
+	snapshot_category = snapshot_category_ids[name]
+
+
+# withinRange() collects the ticks of an item between begin and end
+def snapshot_begin_item():
+	global snapshot_item_ticks
+	if snapshot is not None:
+		snapshot_item_ticks = []
+
+
+# An item of category 'name' that is kept without evaluating its timestamps, so it has no records
+def snapshot_skip_item(name):
+	if snapshot is not None:
+		snapshot_skipped[name] = snapshot_skipped.get(name, 0) + 1
+
+
+def snapshot_end_item(deleted):
+	global snapshot_item_num
+	global snapshot_item_ticks
+	if snapshot is None or snapshot_item_ticks is None:
+		return
+	flags = 0
+	if deleted:
+		flags = SNAPSHOT_DELETED
+	records = []
+	if len(snapshot_item_ticks) == 0:
+		records.append(SNAPSHOT_RECORD.pack(snapshot_item_num, snapshot_category, flags | SNAPSHOT_NONE, 0))
+	span = snapshot_spans[snapshot_categories[snapshot_category]]
+	sample = snapshot_samples[snapshot_categories[snapshot_category]]
+	for ticks in snapshot_item_ticks:
+		records.append(SNAPSHOT_RECORD.pack(snapshot_item_num, snapshot_category, flags, ticks))
+		if span[0] is None or ticks < span[0]:
+			span[0] = ticks
+		if span[1] is None or ticks > span[1]:
+			span[1] = ticks
+		sample[1] -= 1
+		if sample[1] == 0:
+			sample[2].append(ticks)
+			if len(sample[2]) >= 2*SNAPSHOT_SAMPLES:
+				del sample[2][1::2]
+				sample[0] *= 2
+			sample[1] = sample[0]
+	span[2] += 1
+	try:
+		snapshot.write(''.join(records))
+	except Exception as e:
+		debug("Error writing timestamp snapshot: "+str(e), 'snapshot error writing log')
+	snapshot_item_num += 1
+	snapshot_item_ticks = None
+
+
+def snapshot_close(filename):
+	global snapshot
+	if snapshot is None:
+		return
+	quartiles = {}
+	for name, (stride, countdown, ticks) in snapshot_samples.items():
+		if len(ticks) > 0:
+			ticks.sort()
+			n = len(ticks)
+			quartiles[name] = [ticks[n//4], ticks[n//2], ticks[(3*n)//4]]
+	try:
+		snapshot.close()
+		index = open(filename+'.json', 'w')
+		json.dump({
+			'magic': SNAPSHOT_MAGIC,
+			'device': snapshot_device,
+			'fingerprint': snapshot_fingerprint,
+			'categories': snapshot_categories,
+			'items': snapshot_item_num,
+			'spans': snapshot_spans,
+			'quartiles': quartiles,
+			'carried': snapshot_carried,
+			'skipped': snapshot_skipped,
+			'start_ticks': start_ticks,
+			'end_ticks': end_ticks,
+			'doNotDateFilterDeleted': doNotDateFilterDeleted,
+			'doNotFilterContact_by_LastContacted': doNotFilterContact_by_LastContacted,
+			'deviceTimeZone': deviceTimeZone,
+			'exifFallback': exifFallback,
+			'containerTimestamps': containerTimestamps,
+			}, index, indent=1)
+		index.close()
+	except Exception as e:
+		msg = "Unable to finish timestamp snapshot "+filename+": "+str(e)
+		print(msg)
+		debug(msg, 'snapshot close error writing log')
+	snapshot = None
+
+
+# Newest snapshot in Logs with the same snapshot_fingerprint. The options that
+# add timestamps to Data Files must also match, as the spans were computed with them.
+def load_previous_spans():
+	global previous_spans
+	global previous_quartiles
+	previous_spans = {}
+	previous_quartiles = {}
+	if usePreviousSnapshot is not True:
+		return
+	newest = None
+	newest_mtime = 0
+	try:
+		for name in os.listdir('./Logs'):
+			if not name.endswith('.snapshot.json'):
+				continue
+			mtime = os.path.getmtime('./Logs/'+name)
+			if newest is not None and mtime <= newest_mtime:
+				continue
+			index = open('./Logs/'+name)
+			try:
+				prev = json.load(index)
+			finally:
+				index.close()
+			if prev.get('magic') == SNAPSHOT_MAGIC and snapshot_fingerprint is not None \
+			and prev.get('fingerprint') == snapshot_fingerprint \
+			and prev.get('exifFallback') == exifFallback \
+			and prev.get('containerTimestamps') == containerTimestamps:
+				newest = name
+				newest_mtime = mtime
+				previous_spans = prev.get('spans', {})
+				previous_quartiles = prev.get('quartiles', {})
+	except Exception as e:
+		previous_spans = {}
+		previous_quartiles = {}
+		msg = "Unable to read previous snapshot: "+str(e)
+		print(msg)
+		debug(msg, 'previous snapshot error writing log')
+		return
+	if newest is not None:
+		msg = "Using category spans of previous snapshot "+newest+"\n"
+		print(msg)
+		debug(msg, 'previous snapshot error writing log')
+
+
+# SPAN_INSIDE or SPAN_OUTSIDE if every timestamp of category 'name' in the
+# previous snapshot is inside or outside the date range. None otherwise,
+# or if the number of items changed since then.
+def category_span(name, nitems):
+	if sanityCheckTimestamps is True:
+		return None
+	name = str(name)
+	span = previous_spans.get(name)
+	if span is None or span[2] != nitems:
+		return None
+	# chat messages are checked individually
+	if name+'.Messages' in previous_spans:
+		return None
+	lo, hi = span[0], span[1]
+	if lo is None or (lo >= start_ticks and hi <= end_ticks):
+		result = SPAN_INSIDE
+	elif hi < start_ticks or lo > end_ticks:
+		result = SPAN_OUTSIDE
+	else:
+		return None
+	if snapshot is not None:
+		# not re-measured, so no span is carried into the new snapshot
+		if name in snapshot_spans:
+			del snapshot_spans[name]
+		snapshot_carried.append(name)
+	return result
+
+
+# Timestamp sanity check
+# With sanityCheckTimestamps, implausible timestamps are treated as None
+# instead of deciding the verdict, so deleted items with garbage timestamps
+# can be date filtered too. A timestamp is implausible if it is
+#   - before sanityMinYear or more than sanityFutureDays after the run,
+#   - exactly a common epoch (1970-01-01 or 2001-01-01 00:00:00 UTC), or
+#   - a far outlier of its category: outside the quartiles of the category
+#     in the previous snapshot by more than sanityOutlierIQR times the
+#     interquartile range.
+# The snapshot keeps an evenly spaced sample of up to 2*SNAPSHOT_SAMPLES
+# ticks per category, whose quartiles are written to its .json.
+# Span pruning is not used with the sanity check, since the previous spans
+# include the implausible timestamps.
+sanityCheckTimestamps = False
+sanityMinYear = 1990
+sanityFutureDays = 366
+sanityOutlierIQR = 3.0
+SNAPSHOT_SAMPLES = 1024
+
+sanity_min_ticks = 0
+sanity_max_ticks = 0
+sanity_epochs = set()
+# category: (lowest, highest) plausible ticks
+sanity_fences = {}
+sanity_category = ''
+sanity_item_flagged = False
+# category: number of implausible timestamps
+sanity_flagged = {}
+sanity_categories = []
+
+def sanity_begin(quartiles):
+	global sanity_min_ticks
+	global sanity_max_ticks
+	global sanity_epochs
+	global sanity_fences
+	global sanity_flagged
+	global sanity_categories
+	sanity_min_ticks = civilTicks(sanityMinYear, 1, 1, 0, 0, 0)
+	sanity_max_ticks = civilTicks(*datetime.utcnow().timetuple()[:6]) + sanityFutureDays*TICKS_PER_DAY
+	sanity_epochs = set([civilTicks(1970, 1, 1, 0, 0, 0), civilTicks(2001, 1, 1, 0, 0, 0)])
+	sanity_fences = {}
+	sanity_flagged = {}
+	sanity_categories = []
+	for name, (q1, q2, q3) in quartiles.items():
+		iqr = q3 - q1
+		if iqr > 0:
+			sanity_fences[name] = (q1 - sanityOutlierIQR*iqr, q3 + sanityOutlierIQR*iqr)
+
+
+def sanity_set_category(name):
+	global sanity_category
+	sanity_category = str(name)
+
+
+# True if ticks is implausible for the current category
+def implausible(ticks):
+	global sanity_item_flagged
+	if sanity_min_ticks <= ticks <= sanity_max_ticks and ticks not in sanity_epochs:
+		fence = sanity_fences.get(sanity_category)
+		if fence is None or fence[0] <= ticks <= fence[1]:
+			return False
+	if sanity_category not in sanity_flagged:
+		sanity_flagged[sanity_category] = 0
+		sanity_categories.append(sanity_category)
+	sanity_flagged[sanity_category] += 1
+	sanity_item_flagged = True
+	return True
+
+
+def sanity_report():
+	if sanityCheckTimestamps is not True:
+		return
+	msg = "\nImplausible timestamps treated as None:"
+	for name in sanity_categories:
+		msg += "\n\t"+name+": "+str(sanity_flagged[name])
+	if len(sanity_categories) == 0:
+		msg += " none"
+	print(msg)
+	debug(msg, 'sanity report error writing log')
+
+
+# Timeline
+# build_timeline() evaluates every timestamp of the datastore without
+# removing anything and counts them per category, so a proposed range can
+# be previewed before filtering. Each category has a fixed size array of
+# counts per day from TIMEZONE_FIRST_YEAR to TIMEZONE_LAST_YEAR, and an
+# array of 24 hour counts for each day that has timestamps. Timestamps
+# outside of those years are only counted as before or after.
+# timeline_count() sums the buckets of a range, to the hour, without
+# evaluating any item again.
+TICKS_PER_HOUR = 3600*TICKS_PER_SECOND
+TIMELINE_FIRST_DAY = civilTicks(TIMEZONE_FIRST_YEAR, 1, 1, 0, 0, 0)//TICKS_PER_DAY
+TIMELINE_DAYS = civilTicks(TIMEZONE_LAST_YEAR+1, 1, 1, 0, 0, 0)//TICKS_PER_DAY - TIMELINE_FIRST_DAY
+TIMELINE_PREVIEW_LINES = 15
+
+# category: [day counts, {day: hour counts}, before, after]. None until build_timeline().
+timeline = None
+timeline_categories = []
+# True during build_timeline()
+timeline_building = False
+# buckets of the current category while building, None otherwise
+timeline_category = None
+
+def timeline_begin():
+	global timeline
+	global timeline_categories
+	global timeline_category
+	global timeline_building
+	timeline = {}
+	timeline_categories = []
+	timeline_category = None
+	timeline_building = True
+
+
+# Following timestamps belong to category 'name'
+def timeline_set_category(name):
+	global timeline_category
+	if timeline_building is not True:
+		return
+	name = str(name)
+	if name not in timeline:
+		timeline[name] = [array('l', [0])*TIMELINE_DAYS, {}, 0, 0]
+		timeline_categories.append(name)
+	timeline_category = timeline[name]
+
+
+# Called by withinRange() for each timestamp while building
+def timeline_add(ticks):
+	day, hour = divmod(ticks//TICKS_PER_HOUR, 24)
+	day -= TIMELINE_FIRST_DAY
+	buckets = timeline_category
+	if day < 0:
+		buckets[2] += 1
+	elif day >= TIMELINE_DAYS:
+		buckets[3] += 1
+	else:
+		buckets[0][day] += 1
+		hours = buckets[1].get(day)
+		if hours is None:
+			hours = buckets[1][day] = array('l', [0])*24
+		hours[hour] += 1
+
+
+def timeline_hours(hours, day, first, last):
+	if day not in hours:
+		return 0
+	return sum(hours[day][first:last+1])
+
+
+# {category: (timestamps from start to end UTC ticks, all timestamps)}
+def timeline_count(start, end):
+	h0 = start//TICKS_PER_HOUR - TIMELINE_FIRST_DAY*24
+	h1 = end//TICKS_PER_HOUR - TIMELINE_FIRST_DAY*24
+	counts = {}
+	for name in timeline_categories:
+		days, hours, before, after = timeline[name]
+		n = 0
+		if h0 < 0:
+			n += before
+		if h1 >= TIMELINE_DAYS*24:
+			n += after
+		lo = max(h0, 0)
+		hi = min(h1, TIMELINE_DAYS*24-1)
+		if lo <= hi:
+			d0, r0 = divmod(lo, 24)
+			d1, r1 = divmod(hi, 24)
+			if d0 == d1:
+				n += timeline_hours(hours, d0, r0, r1)
+			else:
+				n += timeline_hours(hours, d0, r0, 23) + sum(days[d0+1:d1]) + timeline_hours(hours, d1, 0, r1)
+		counts[name] = (n, sum(days)+before+after)
+	return counts
+
+
+# Preview text of timeline_count(), the categories with most timestamps in range first
+def timeline_summary(counts):
+	within = total = 0
+	for n, all_ticks in counts.values():
+		within += n
+		total += all_ticks
+	msg = "Timestamps within range: "+str(within)+" of "+str(total)+"\n"
+	msg += "(an item is kept if any of its timestamps is within range)\n"
+	names = [name for name in timeline_categories if counts[name][0] > 0]
+	names.sort(key=lambda name: -counts[name][0])
+	for name in names[:TIMELINE_PREVIEW_LINES]:
+		msg += "\n"+name+": "+str(counts[name][0])+" of "+str(counts[name][1])
+	if len(names) > TIMELINE_PREVIEW_LINES:
+		msg += "\n... "+str(len(names)-TIMELINE_PREVIEW_LINES)+" more categories"
+	return msg
+
+
+# Item identity
+# Items are identified across runs by "<category>:<16 hex digits>", a SHA-1
+# of the category and a key of the item:
+#   Data Files: source path (AbsolutePath, or Name)
+#   Analyzed Data and chat messages: the file and offset PA parsed them from
+#     (model_source()) and the UTC ticks of their timestamps, in the order
+#     they are evaluated (collected by withinRange()), except collections
+#     such as AllTimeStamps
+#   DeviceInfo: name and value
+# Items of a category with the same key (identical duplicates, or items
+# with neither a source nor timestamps) are told apart by their ordinal
+# among the items with that key, in traversal order. Only the ordinals of
+# the categories being traversed are kept, and they are saved with the
+# checkpoint. Cached and resumed verdicts keep the identities they were
+# given.
+ITEM_ID_DIGITS = 16
+# chat message timestamps, in the order filter_AnalyzedData2() evaluates them
+MESSAGE_TIMEFIELDS = ['TimeStamp', 'StartTime', 'DateDelivered', 'DateRead', 'DatePlayed', 'Date']
+
+# ticks of the current item
+item_ticks = []
+# category: {key digest: number of items with that key so far}
+identity_ordinals = {}
+
+def identity_begin():
+	global item_ticks
+	global identity_ordinals
+	item_ticks = []
+	identity_ordinals = {}
+
+
+# Following items belong to the categories 'names', the ordinals of other categories are dropped
+def identity_set_category(*names):
+	global identity_ordinals
+	ordinals = {}
+	for name in names:
+		ordinals[name] = identity_ordinals.get(name, {})
+	identity_ordinals = ordinals
+
+
+# Identity of the next item of category. Without a key, the key is source
+# and the ticks withinRange() collected for the item.
+def item_identity(category, key=None, source=''):
+	global item_ticks
+	if key is None:
+		key = source_key(source, ",".join([str(t) for t in item_ticks]))
+	item_ticks = []
+	key = category+"\n"+key
+	digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:ITEM_ID_DIGITS]
+	seen = identity_ordinals.setdefault(category, {})
+	n = seen.get(digest, 0)
+	seen[digest] = n + 1
+	if n > 0:
+		digest = hashlib.sha1((key+"\n#"+str(n)).encode('utf-8')).hexdigest()[:ITEM_ID_DIGITS]
+	return category+":"+digest
+
+
+def source_key(source, ticks):
+	if source:
+		return source+"\n"+ticks
+	return ticks
+
+
+# "<path>@<offset>" of the file PA parsed model item f from, '' if PA does not tell
+def model_source(f):
+	try:
+		for n in f.SourceInfo.Nodes:
+			node = getattr(n, 'Node', n)
+			source = unicode(node.AbsolutePath)
+			try:
+				source += "@"+str(n.Chunks[0].Offset)
+			except Exception:
+				pass
+			return source
+	except Exception:
+		pass
+	return ''
+
+
+def file_key(f):
+	path = getattr(f, 'AbsolutePath', None)
+	if not path:
+		path = f.Name
+	return path
+
+
+# Same ticks as withinRange() collects for a model item or message
+def model_key(f, timefields):
+	ticks = []
+	for tf in timefields:
+		if tf in COLLECTION_TIMEFIELDS:
+			continue
+		try:
+			ts_val = getattr(f, tf).Value
+			if ts_val is not None:
+				ticks.append(toTicks(ts_val))
+		except Exception:
+			pass
+	return source_key(model_source(f), ",".join([str(t) for t in ticks if t is not None]))
+
+
+def message_key(im):
+	return model_key(im, [tf for tf in MESSAGE_TIMEFIELDS if im.FieldExists(tf)])
+
+
+# Audit
+# Every kept or removed item is written to <log>.audit.jsonl, one JSON
+# record per line:
+#   {"id": <item identity>, "category": ..., "index": <position in category>,
+#    "verdict": "kept" or "removed", "rule": ...,
+#    "field": <deciding timestamp field>, "ticks": <its UTC ticks>}
+# The deciding field is the first timestamp within range, or the last one
+# evaluated if none is. Rules:
+#   in-range, out-of-range, no-timestamps, deleted (deleted items are not date filtered),
+#   implausible (only implausible timestamps, see sanityCheckTimestamps),
+#   exempt (model type skipped by the timestamp policy),
+#   span-inside, span-outside (decided from the previous snapshot),
+#   cached (verdict from the verdict cache)
+#   chat-envelope (chat message kept by its chat's StartTime and LastActivity)
+#   attachment, orphan-attachment (Data File kept or removed with the items
+#     it is attached to, see keepAttachmentsWithItems)
+# Records are written in batches of auditBatchRecords. <log>.audit.summary.jsonl
+# has one record per category with its kept and removed counts per rule.
+# The verdict cache and the checkpoint refer to the audit of the run that
+# classified their items (file and number of records written). A run using
+# cached verdicts, or resuming from a checkpoint, copies those records
+# first (audit_carry()), so the audit still has one record per item. If
+# they cannot be copied, the removed items of cached verdicts are audited
+# with rule 'cached', and the summary starts with a record
+# {"partial": true, "reason": ...} saying which items have no record.
+writeAudit = True
+auditBatchRecords = 8192
+
+audit = None
+audit_filename = None
+# records written to the audit file
+audit_records = 0
+audit_batch = []
+audit_summary = {}
+audit_categories = []
+audit_field = None
+audit_ticks = None
+audit_in_range = False
+# reason the audit does not have a record for every item, None if it does
+audit_partial = None
+
+def audit_open(filename):
+	global audit
+	global audit_filename
+	global audit_records
+	global audit_batch
+	global audit_summary
+	global audit_categories
+	global audit_partial
+	audit_filename = filename
+	audit_records = 0
+	audit_batch = []
+	audit_summary = {}
+	audit_categories = []
+	audit_partial = None
+	if writeAudit is not True:
+		audit = None
+		return
+	try:
+		audit = open(filename, 'w')
+	except Exception as e:
+		audit = None
+		msg = "Unable to write audit "+filename+": "+str(e)
+		print(msg)
+		debug(msg, 'audit open error writing log')
+
+
+# [audit file, records written] for the verdict cache and checkpoint, None without an audit
+def audit_position():
+	if audit is None:
+		return None
+	audit_flush()
+	return [audit_filename, audit_records]
+
+
+# Copies the first records of the audit at 'position' (audit_position() of
+# an earlier run) to this one. False if they cannot all be copied.
+def audit_carry(position):
+	global audit_records
+	if audit is None:
+		return True
+	if position is None:
+		return False
+	filename, records = position
+	if records == 0:
+		return True
+	lines = []
+	try:
+		earlier = open(filename)
+		try:
+			for line in earlier:
+				if len(lines) == records:
+					break
+				record = json.loads(line)
+				lines.append(line.rstrip("\n"))
+				audit_count(record['category'], record['verdict'], record['rule'])
+		finally:
+			earlier.close()
+	except Exception as e:
+		debug("Unable to copy audit "+str(filename)+": "+str(e), 'audit error writing log')
+		lines = []
+	if len(lines) < records:
+		# nothing was written, so nothing is counted
+		audit_summary.clear()
+		del audit_categories[:]
+		return False
+	audit_flush()
+	try:
+		audit.write("\n".join(lines)+"\n")
+		audit_records += len(lines)
+	except Exception as e:
+		debug("Error writing audit: "+str(e), 'audit error writing log')
+		return False
+	msg = "Audit: copied "+str(len(lines))+" records of "+filename
+	print(msg)
+	debug(msg, 'audit error writing log')
+	return True
+
+
+# Marks the audit as not having a record for every item
+def audit_mark_partial(reason):
+	global audit_partial
+	if audit is None:
+		return
+	audit_partial = reason
+	msg = "Audit is partial: "+reason
+	print(msg)
+	debug(msg, 'audit error writing log')
+
+
+def audit_count(category, verdict, rule):
+	if category not in audit_summary:
+		audit_summary[category] = {'kept': 0, 'removed': 0, 'rules': {}}
+		audit_categories.append(category)
+	summary = audit_summary[category]
+	summary[verdict] += 1
+	summary['rules'][rule] = summary['rules'].get(rule, 0) + 1
+
+
+# Called by withinRange() for each timestamp of an item
+def audit_timestamp(field, ticks, inside):
+	global audit_field
+	global audit_ticks
+	global audit_in_range
+	if audit is None or audit_in_range:
+		return
+	audit_field = field
+	audit_ticks = ticks
+	audit_in_range = inside
+
+
+# Rule that decided the verdict of the current item
+def audit_rule(kept, deleted, span=None):
+	if kept:
+		if deleted and doNotDateFilterDeleted is True:
+			return 'deleted'
+		if audit_in_range:
+			return 'in-range'
+		if sanity_item_flagged:
+			return 'implausible'
+		return 'no-timestamps'
+	if span == SPAN_OUTSIDE:
+		return 'span-outside'
+	return 'out-of-range'
+
+
+def audit_item(category, index, item_id, kept, rule, field=None, ticks=None):
+	global audit_field
+	global audit_ticks
+	global audit_in_range
+	global sanity_item_flagged
+	if audit is not None:
+		if field is None:
+			field = audit_field
+			ticks = audit_ticks
+		verdict = 'removed'
+		if kept:
+			verdict = 'kept'
+		audit_batch.append(json.dumps({
+			'id': item_id,
+			'category': category,
+			'index': index,
+			'verdict': verdict,
+			'rule': rule,
+			'field': field,
+			'ticks': ticks,
+			}, sort_keys=True))
+		if len(audit_batch) >= auditBatchRecords:
+			audit_flush()
+		audit_count(category, verdict, rule)
+	audit_field = None
+	audit_ticks = None
+	audit_in_range = False
+	sanity_item_flagged = False
+
+
+# All items of a category kept by the same rule: audited and their
+# attachments indexed. key(f) is the identity key of item f.
+def audit_items_kept(category, items, rule, first=0, key=None):
+	attachments = keepAttachmentsWithItems is True and len(items) > 0 and has_attachments(category, items[0])
+	if audit is None and not attachments:
+		return
+	index = first
+	for f in items:
+		k = None
+		if key is not None:
+			k = key(f)
+		item_id = item_identity(category, k)
+		audit_item(category, index, item_id, True, rule)
+		if attachments:
+			index_attachments(category, f, item_id, True)
+		index += 1
+
+
+# Removed items of the verdicts
+def audit_verdicts(rule):
+	for cn, index, item_id, f in verdicts['DataFiles']:
+		audit_item(cn, index, item_id, False, rule)
+	for cn, index, item_id, f in verdicts['Models']:
+		audit_item(cn, index, item_id, False, rule)
+	for cn, index, im_index, item_id, im in verdicts['Messages']:
+		audit_item(cn+'.Messages', str(index)+"/"+str(im_index), item_id, False, rule)
+	for index, item_id, i in verdicts['DeviceInfo']:
+		audit_item('DeviceInfo', index, item_id, False, rule)
+
+
+def audit_flush():
+	global audit_batch
+	global audit_records
+	if len(audit_batch) == 0:
+		return
+	try:
+		audit.write("\n".join(audit_batch)+"\n")
+		audit_records += len(audit_batch)
+	except Exception as e:
+		debug("Error writing audit: "+str(e), 'audit error writing log')
+	audit_batch = []
+
+
+def audit_close(filename):
+	global audit
+	if audit is None:
+		return
+	audit_flush()
+	audit.close()
+	audit = None
+	try:
+		summary_file = open(filename[:-len('.jsonl')]+'.summary.jsonl', 'w')
+		if audit_partial is not None:
+			summary_file.write(json.dumps({'partial': True, 'reason': audit_partial}, sort_keys=True)+"\n")
+		for category in audit_categories:
+			summary = audit_summary[category]
+			summary_file.write(json.dumps({
+				'category': category,
+				'kept': summary['kept'],
+				'removed': summary['removed'],
+				'rules': summary['rules'],
+				}, sort_keys=True)+"\n")
+		summary_file.close()
+	except Exception as e:
+		msg = "Unable to write audit summary: "+str(e)
+		print(msg)
+		debug(msg, 'audit close error writing log')
+
+
+# Timestamp policy for Analyzed Data
+# 'fields' are the timestamp fields evaluated for every model type.
+# 'types' overrides them per model type (e.g. "Data.Models.SMS"):
+#     'fields' replaces the default list, 'ignore' drops fields from it and
+#     'exempt': true skips the model type so all of its items are kept.
+# 'doNotFilterContact_by_LastContacted' is applied on top of that when the
+# Contact's LastContacted check box is checked.
+# A JSON file with the same layout at timestampPolicyFile replaces this default,
+# so new PA model types can be handled without editing the script.
+timestampPolicyFile = "./PA_date_filter_policy.json"
+
+# 35 TimeStamps. Duration removed. AllTimeStamps may need review.
+# 
+# update 2017-03-08  PA 5.4's Voicemail field has 'Timestamp' field instead of 'TimeStamp'.  Notice the lower case 's'.
+DEFAULT_TIMESTAMP_POLICY = {
+	'fields': [
+		'TimeContacted',
+		'TimeCreated',
+		'TimeModified',
+		'TimeLastLoggedIn',
+		'DateDelivered',
+		'DateRead',
+		'DatePlayed',
+		'TimeStamp',
+		'Timestamp',
+		'AllTimeStamps',
+		'StartTime',
+		'LastActivity',
+		'Creation',
+		'Modification',
+		'StartDate',
+		'EndDate',
+		'Reminder',
+		'RepeatUntil',
+		'EndTime',
+		'Expiry',
+		'CreationTime',
+		'LastAccessTime',
+		'LastVisited',
+		'LastConnected',
+		'LastConnection',
+		'LastAutoConnection',
+		'PurchaseDate',
+		'DeletedDate',
+		'Date',
+		'LastLaunch',
+		'PurchaseTime',
+		'ModifyTime',
+		'ActivationTime',
+		'ExpirationTime',
+		],
+	'types': {},
+	# Assumption: TimeContacted timestamp is only used by Contacts.
+	# Currently this is true. If other categories use the TimeContacted timestamp,
+	# this will prevent those categories from being date filtered properly. 
+	'doNotFilterContact_by_LastContacted': {
+		'ignore': ['TimeContacted'],
+		'exempt': ['Data.Models.ContactModels.Contact'],
+		},
+	}
+
+# PA version adapter, probed once by probe_datastore()
+# PA 5.3 keeps the checked Data Files in ds.TaggedFiles, categories by Name.
+# Since PA 5.4 ds.DataFiles is used instead, categories by Key.
+# Voicemail 'TimeStamp' vs 'Timestamp' (PA 5.4) is resolved per model type
+# by model_fields(). EXIF date formats by exif_date_format.
+pa_version = ''
+pa_files = None
+pa_category_attr = ''
+
+def probe_datastore():
+	global pa_version
+	global pa_files
+	global pa_category_attr
+	if pa_files is not None:
+		return True
+	# ds.TaggedFiles throws since PA 5.4
+	try:
+		if ds.TaggedFiles is not None:
+			pa_version = 'PA 5.3'
+			pa_files = ds.TaggedFiles
+			pa_category_attr = 'Name'
+			return True
+	except Exception as e:
+		pass
+	try:
+		if ds.DataFiles is not None:
+			pa_version = 'PA 5.4'
+			pa_files = ds.DataFiles
+			pa_category_attr = 'Key'
+			return True
+	except Exception as e:
+		pass
+	return False
+
+
+# (category key, Data Files of the category) for all Data Files categories
+def iter_DataFiles():
+	for category in pa_files:
+		key = getattr(category, pa_category_attr)
+		yield key, pa_files[key]
+
+
+# Type metadata, built once per run by build_type_cache()
+# model type -> (full name, short name, chat messages category name)
+model_types = {}
+# Data Files category key -> (full name, short name)
+datafile_categories = {}
+# model types that are not date filtered
+skipped_model_types = set()
+# model type -> timestamp fields from the policy
+policy_fields = {}
+# model type -> policy fields that exist on the model type's items
+model_fields_cache = {}
+
+def model_type_info(model_type):
+	info = model_types.get(model_type)
+	if info is None:
+		cn = str(model_type)
+		info = (cn, cn.split('.')[-1], cn+'.Messages')
+		model_types[model_type] = info
+	return info
+
+
+def datafile_category_info(key):
+	info = datafile_categories.get(key)
+	if info is None:
+		cn = str(key)
+		info = (cn, cn.split('.')[-1])
+		datafile_categories[key] = info
+	return info
+
+
+# Loaded once and reused by later runs (e.g. batch cases)
+timestamp_policy = None
+
+# Describes what is wrong with the layout of a timestamp policy, None if it
+# has the layout of DEFAULT_TIMESTAMP_POLICY
+def policy_layout_error(policy):
+	def is_names(value):
+		return isinstance(value, list) and len([n for n in value if not isinstance(n, basestring)]) == 0
+	if not isinstance(policy, dict):
+		return "not a JSON object"
+	if not is_names(policy.get('fields')):
+		return "'fields' must be a list of field names"
+	types = policy.get('types', {})
+	if not isinstance(types, dict):
+		return "'types' must be an object of model types"
+	for cn, rule in types.items():
+		if not isinstance(rule, dict):
+			return "rule of type "+cn+" must be an object"
+		for key in ['fields', 'ignore']:
+			if key in rule and not is_names(rule[key]):
+				return "'"+key+"' of type "+cn+" must be a list of field names"
+		if 'exempt' in rule and not isinstance(rule['exempt'], bool):
+			return "'exempt' of type "+cn+" must be true or false"
+	contact = policy.get('doNotFilterContact_by_LastContacted', {})
+	if not isinstance(contact, dict):
+		return "'doNotFilterContact_by_LastContacted' must be an object"
+	for key in ['ignore', 'exempt']:
+		if key in contact and not is_names(contact[key]):
+			return "'"+key+"' of doNotFilterContact_by_LastContacted must be a list of names"
+	return None
+
+
+def load_timestamp_policy():
+	global timestamp_policy
+	if timestamp_policy is not None:
+		return timestamp_policy
+	try:
+		policy_file = open(timestampPolicyFile)
+	except IOError:
+		timestamp_policy = DEFAULT_TIMESTAMP_POLICY
+		return timestamp_policy
+	try:
+		try:
+			policy = json.load(policy_file)
+		finally:
+			policy_file.close()
+		error = policy_layout_error(policy)
+		if error is not None:
+			raise ValueError(error)
+		timestamp_policy = policy
+		msg = "Using timestamp policy "+timestampPolicyFile
+		print(msg)
+		debug(msg, 'timestamp policy error writing log')
+	except Exception as e:
+		msg = "Unable to read timestamp policy "+timestampPolicyFile+": "+str(e)+". Using default policy."
+		print(msg)
+		debug(msg, 'timestamp policy error writing log')
+		timestamp_policy = DEFAULT_TIMESTAMP_POLICY
+	return timestamp_policy
+
+
+# Compiles the timestamp policy into the timestamp fields of each model type
+def build_type_cache():
+	global model_types
+	global datafile_categories
+	global skipped_model_types
+	global policy_fields
+	global model_fields_cache
+	global model_getters_cache
+	model_types = {}
+	datafile_categories = {}
+	skipped_model_types = set()
+	policy_fields = {}
+	model_fields_cache = {}
+	model_getters_cache = {}
+
+	policy = load_timestamp_policy()
+	types = policy.get('types', {})
+	ignore_all = []
+	exempt = []
+	if doNotFilterContact_by_LastContacted is True:
+		contact = policy.get('doNotFilterContact_by_LastContacted', {})
+		ignore_all = contact.get('ignore', [])
+		exempt = contact.get('exempt', [])
+
+	for m in ds.Models:
+		cn = model_type_info(m.ModelType)[0]
+		rule = types.get(cn, {})
+		if rule.get('exempt') is True or cn in exempt:
+			skipped_model_types.add(m.ModelType)
+			continue
+		ignore = rule.get('ignore', []) + ignore_all
+		policy_fields[m.ModelType] = [str(tf) for tf in rule.get('fields', policy['fields']) if tf not in ignore]
+
+
+# Policy timestamp fields of model_type that exist on its items.
+# The fields of a model type are the same for all of its items, so
+# FieldExists() is only called on the first item.
+def model_fields(model_type, item):
+	fields = model_fields_cache.get(model_type)
+	if fields is None:
+		fields = [tf for tf in policy_fields[model_type] if item.FieldExists(tf)]
+		model_fields_cache[model_type] = fields
+	return fields
+
+
+# Cached accessors
+# With useCachedAccessors, the Analyzed Data loop reads f.<field>.Value
+# through an accessor resolved once per model type and field instead of two
+# dynamic member lookups per read. It is off until bench_accessors() shows a
+# gain on the PA version in use.
+useCachedAccessors = False
+# model type -> [(field, accessor of its Value or None)]
+model_getters_cache = {}
+
+# Accessor of the Value of field tf of items of the type of 'item': the .NET
+# properties are reflected once and read with PropertyInfo.GetValue(). An
+# operator.attrgetter where they cannot be reflected.
+def value_getter(item, tf):
+	try:
+		field = clr.GetClrType(type(item)).GetProperty(tf)
+		value = field.PropertyType.GetProperty('Value')
+	except Exception:
+		field = value = None
+	if field is None or value is None:
+		return operator.attrgetter(tf+'.Value')
+	get_field = field.GetValue
+	get_value = value.GetValue
+	return lambda f: get_value(get_field(f, None), None)
+
+
+# model_fields() with their accessors, once per model type. The accessor is
+# None for collection fields and without useCachedAccessors.
+def model_getters(model_type, item):
+	getters = model_getters_cache.get(model_type)
+	if getters is None:
+		getters = []
+		for tf in model_fields(model_type, item):
+			if useCachedAccessors is True and tf not in COLLECTION_TIMEFIELDS:
+				getters.append((tf, value_getter(item, tf)))
+			else:
+				getters.append((tf, None))
+		model_getters_cache[model_type] = getters
+	return getters
+
+
+# Times 'reads' reads of a timestamp field of the first Analyzed Data item
+# that has one, by getattr(), operator.attrgetter and value_getter().
+# Run it from the PA Python shell: bench_accessors()
+def bench_accessors(reads=10000000):
+	build_type_cache()
+	for m in ds.Models:
+		if m.ModelType in skipped_model_types:
+			continue
+		items = list(ds.Models[m.ModelType])
+		if len(items) == 0:
+			continue
+		fields = [tf for tf in model_fields(m.ModelType, items[0]) if tf not in COLLECTION_TIMEFIELDS]
+		if len(fields) == 0:
+			continue
+		tf = fields[0]
+		f = items[0]
+		t0 = time.time()
+		for i in xrange(reads):
+			getattr(f, tf).Value
+		timings = [('getattr', time.time() - t0)]
+		for name, get_value in [('attrgetter', operator.attrgetter(tf+'.Value')), ('cached accessor', value_getter(f, tf))]:
+			t0 = time.time()
+			for i in xrange(reads):
+				get_value(f)
+			timings.append((name, time.time() - t0))
+		msg = str(reads)+" reads of "+model_type_info(m.ModelType)[0]+"."+tf
+		for name, seconds in timings:
+			msg += "\n\t%s: %.2f s" % (name, seconds)
+		print(msg)
+		return timings
+	print("No Analyzed Data item with a timestamp field")
+	return None
+
+
 # function that does actual date comparison
-def withinRange(timestamp):
+# 'field' is the name of the timestamp for the audit
+def withinRange(timestamp, field=None):
 	global global_all_timestamps_None
 	global global_inside_timeframe
-	
+
+	ticks = toTicks(timestamp)
+	if ticks is not None:
+		item_ticks.append(ticks)
+		if timeline_category is not None:
+			timeline_add(ticks)
+		if snapshot_item_ticks is not None:
+			snapshot_item_ticks.append(ticks)
+		if sanityCheckTimestamps is True and implausible(ticks):
+			return False
+
 	# since we are testing a timeframe, at least 1 timestamp is not None 
 	global_all_timestamps_None = False
 
 	if timestamp >= dt_start and timestamp <= dt_end :
 		global_inside_timeframe = True
+		audit_timestamp(field, ticks, True)
 		return True
 	else:
+		audit_timestamp(field, ticks, False)
+		return False
+
+
+# withinRange() of a timestamp already converted to UTC ticks
+def withinRangeTicks(ticks, field=None):
+	global global_all_timestamps_None
+	global global_inside_timeframe
+	item_ticks.append(ticks)
+	if timeline_category is not None:
+		timeline_add(ticks)
+	if snapshot_item_ticks is not None:
+		snapshot_item_ticks.append(ticks)
+	if sanityCheckTimestamps is True and implausible(ticks):
 		return False
+	global_all_timestamps_None = False
+	inside = start_ticks <= ticks <= end_ticks
+	if inside:
+		global_inside_timeframe = True
+	audit_timestamp(field, ticks, inside)
+	return inside
 
 		
+# EXIF fallback
+# Images whose MetaData PA did not populate would only be judged on their
+# file system times, which extraction often resets. For those, the first
+# exifHeaderBytes of the file are read (one seek and one read, never the
+# whole file) and DateTimeOriginal with OffsetTimeOriginal, or else
+# DateTime with OffsetTime, are parsed from the EXIF TIFF structure found
+# there (JPEG APP1, HEIC Exif item or a TIFF file). Without an offset the
+# time is local to the device (see deviceTimeZone).
+# Before a category is classified, its candidate files are read ahead by
+# exifFallbackWorkers threads. It is 1 (one read at a time): PA's file
+# streams may share the handle of the extraction image, and a race between
+# two seeks and reads would silently change verdicts. Only raise it once the
+# streams are known to be thread safe.
+# Parse results are cached by the file's path (see file_key()), so a file
+# is read once per session, e.g. by a Preview and then a Filter.
+exifFallback = True
+exifHeaderBytes = 64*1024
+exifFallbackWorkers = 1
+EXIF_FALLBACK_EXTENSIONS = ('.jpg', '.jpeg', '.heic', '.heif', '.tif', '.tiff')
+EXIF_TIFF_HEADERS = ('II*\x00', 'MM\x00*')
+EXIF_TAG_DATETIME = 0x0132
+EXIF_TAG_EXIF_IFD = 0x8769
+EXIF_TAG_DATETIME_ORIGINAL = 0x9003
+EXIF_TAG_OFFSET_TIME = 0x9010
+EXIF_TAG_OFFSET_TIME_ORIGINAL = 0x9011
+EXIF_DATETIME = re.compile(r'^(\d{4}):(\d\d):(\d\d)[ T](\d\d):(\d\d):(\d\d)')
+
+# file key: (date time, UTC offset or None), or None
+exif_header_cache = {}
+# file key: UTC ticks or None, read ahead for the current category
+exif_fallback_results = {}
+
+# True for a deleted file kept by doNotDateFilterDeleted
+def kept_deleted(f):
+	return doNotDateFilterDeleted is True and f.Deleted is not None and str(f.Deleted) == "Deleted"
+
+
+def needs_exif_fallback(f):
+	if exifFallback is not True or f.MetaData is not None or f.Name is None:
+		return False
+	return str(f.Name).lower().endswith(EXIF_FALLBACK_EXTENSIONS)
+
+
+# Offset of the EXIF TIFF header in header, -1 if there is none
+def exif_tiff_start(header):
+	if header[:4] in EXIF_TIFF_HEADERS:
+		return 0
+	i = header.find('Exif\x00\x00')
+	while i >= 0:
+		if header[i+6:i+10] in EXIF_TIFF_HEADERS:
+			return i+6
+		i = header.find('Exif\x00\x00', i+1)
+	return -1
+
+
+# {tag: (type, count, position of the value or of its offset)} of the IFD at offset
+def exif_ifd(header, base, offset, fmt):
+	pos = base + offset
+	if offset <= 0 or pos + 2 > len(header):
+		return {}
+	entries = {}
+	n = struct.unpack_from(fmt+'H', header, pos)[0]
+	pos += 2
+	for k in range(n):
+		if pos + 12 > len(header):
+			break
+		tag, typ, count = struct.unpack_from(fmt+'HHI', header, pos)
+		entries[tag] = (typ, count, pos+8)
+		pos += 12
+	return entries
+
+
+# ASCII value of an IFD entry, None if it is not one or is outside of header
+def exif_ascii(header, base, entry, fmt):
+	if entry is None:
+		return None
+	typ, count, pos = entry
+	if typ != 2:
+		return None
+	if count > 4:
+		pos = base + struct.unpack_from(fmt+'I', header, pos)[0]
+	value = header[pos:pos+count]
+	if len(value) < count:
+		return None
+	return value.split('\x00')[0].strip()
+
+
+# (date time, UTC offset or None) from the EXIF data in header, None if there is none
+def parse_exif_header(header):
+	base = exif_tiff_start(header)
+	if base < 0:
+		return None
+	fmt = '>'
+	if header[base] == 'I':
+		fmt = '<'
+	try:
+		ifd0 = exif_ifd(header, base, struct.unpack_from(fmt+'I', header, base+4)[0], fmt)
+		exif = {}
+		if EXIF_TAG_EXIF_IFD in ifd0:
+			exif = exif_ifd(header, base, struct.unpack_from(fmt+'I', header, ifd0[EXIF_TAG_EXIF_IFD][2])[0], fmt)
+		for date_entry, offset_entry in [(exif.get(EXIF_TAG_DATETIME_ORIGINAL), exif.get(EXIF_TAG_OFFSET_TIME_ORIGINAL)),
+										(ifd0.get(EXIF_TAG_DATETIME), exif.get(EXIF_TAG_OFFSET_TIME))]:
+			value = exif_ascii(header, base, date_entry, fmt)
+			if value:
+				return value, exif_ascii(header, base, offset_entry, fmt)
+	except struct.error:
+		pass
+	return None
+
+
+# UTC ticks of the EXIF capture time in the header of Data File f, None if there is none
+def read_exif_fallback(f):
+	key = file_key(f)
+	if key in exif_header_cache:
+		found = exif_header_cache[key]
+	else:
+		data = getattr(f, 'Data', None)
+		if data is None:
+			return None
+		data.seek(0)
+		header = data.read(exifHeaderBytes)
+		found = None
+		if header:
+			found = parse_exif_header(header)
+		exif_header_cache[key] = found
+	if found is None:
+		return None
+	value, utc_offset = found
+	m = EXIF_DATETIME.match(value)
+	if m is None:
+		return None
+	offset = None
+	if utc_offset:
+		offset = offsetTicks(utc_offset)
+	yyyy, mm, dd, hr, mn, sec = [int(x) for x in m.groups()]
+	try:
+		return normalizeTicks(yyyy, mm, dd, hr, mn, sec, offset)
+	except ValueError:
+		return None
+
+
+# Reads ahead the EXIF fallback of the files of a category with exifFallbackWorkers threads
+def exif_fallback_prefetch(files):
+	global exif_fallback_results
+	exif_fallback_results = {}
+	todo = [f for f in files if needs_exif_fallback(f) and not kept_deleted(f)]
+	if len(todo) == 0:
+		return 0
+	# the time zone table is built once, before the workers use it
+	timezone_table(deviceTimeZone)
+	results = exif_fallback_results
+	def work(part):
+		for f in part:
+			try:
+				results[file_key(f)] = read_exif_fallback(f)
+			except Exception:
+				results[file_key(f)] = None
+	workers = max(1, min(exifFallbackWorkers, len(todo)))
+	if workers == 1:
+		work(todo)
+	else:
+		threads = [threading.Thread(target=work, args=(todo[i::workers],)) for i in range(workers)]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+	found = len([ticks for ticks in results.values() if ticks is not None])
+	msg = "EXIF fallback: read the header of "+str(len(todo))+" files without MetaData, "+str(found)+" with a capture time"
+	print(msg)
+	debug(msg, 'EXIF fallback error writing log')
+	return len(todo)
+
+
+# Container timestamps
+# MP4, MOV, M4A and 3GP files (videos and voice notes) record when they were
+# created and last modified in the mvhd box inside their moov box. Only the
+# 8 or 16 byte header of each box is read, and the walker seeks past its
+# payload to the next one, so a multi-GB video costs a handful of reads
+# whatever its size. mvhd times are seconds since 1904-01-01 UTC, 64 bit in
+# version 1 of the box. A time of zero is not set.
+containerTimestamps = True
+CONTAINER_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.m4a', '.3gp', '.3g2')
+# box headers read before giving up on a file that is not a valid container
+CONTAINER_MAX_BOXES = 64
+MVHD_EPOCH_TICKS = civilTicks(1904, 1, 1, 0, 0, 0)
+
+def needs_container_timestamps(f):
+	if containerTimestamps is not True or f.Name is None:
+		return False
+	return str(f.Name).lower().endswith(CONTAINER_EXTENSIONS)
+
+
+# (size, type, header length) of the box at the current position of data, None at the end
+def container_box_header(data):
+	header = data.read(8)
+	if len(header) < 8:
+		return None
+	size, box_type = struct.unpack('>I4s', header)
+	if size == 1:
+		large = data.read(8)
+		if len(large) < 8:
+			return None
+		return struct.unpack('>Q', large)[0], box_type, 16
+	return size, box_type, 8
+
+
+# (start, end) of the payload of the box at path, e.g. ['moov', 'mvhd'], None if there is none.
+# end is None when the box runs to the end of the file.
+def find_container_box(data, path):
+	start = 0
+	end = None
+	reads = 0
+	for box_type in path:
+		pos = start
+		while True:
+			if end is not None and pos + 8 > end:
+				return None
+			if reads >= CONTAINER_MAX_BOXES:
+				return None
+			reads += 1
+			data.seek(pos)
+			box = container_box_header(data)
+			if box is None:
+				return None
+			size, found_type, header_len = box
+			if found_type == box_type:
+				start = pos + header_len
+				if size != 0:
+					end = pos + size
+				break
+			# size 0 runs to the end of the file
+			if size < header_len:
+				return None
+			pos += size
+	return start, end
+
+
+# [creation, modification] UTC ticks from the mvhd box of Data File f, None when not set
+def read_container_timestamps(f):
+	data = getattr(f, 'Data', None)
+	if data is None:
+		return [None, None]
+	box = find_container_box(data, ['moov', 'mvhd'])
+	if box is None:
+		return [None, None]
+	data.seek(box[0])
+	version = data.read(4)
+	if len(version) < 4:
+		return [None, None]
+	fmt = '>II'
+	if version[0] == '\x01':
+		fmt = '>QQ'
+	times = data.read(struct.calcsize(fmt))
+	if len(times) < struct.calcsize(fmt):
+		return [None, None]
+	result = []
+	for seconds in struct.unpack(fmt, times):
+		if seconds == 0:
+			result.append(None)
+		else:
+			result.append(MVHD_EPOCH_TICKS + seconds*TICKS_PER_SECOND)
+	return result
+
+
 # Parses Data Files	
 # ds.TaggedFiles only contains Data Files. Not any Analyzed Data items.
 # ds.TaggedFiles[cateogry.Name] includes deduplicated items 
@@ -155,35 +1867,39 @@ def containsTimeStamp_DataFiles(f) :
 	
 	try:
 		# Node / file  Properties
-		if f.Deleted is not None:
-			if doNotDateFilterDeleted is True and (str(f.Deleted) == "Deleted"):
-				keep = True
-				msg = "\t\tKeeping deleted Data File "+str(f.Name)
+		deleted_kept = kept_deleted(f)
+		if deleted_kept:
+			keep = True
+			msg = "\t\tKeeping deleted Data File "+str(f.Name)+"\n"
+			# Kept, but the timestamps PA already loaded still go to the
+			# snapshot, as those of deleted models do, for offline runs that
+			# filter deleted items. The file itself is not read.
+			if snapshot_item_ticks is None:
 				return True
 				
 		if f.CreationTime is not None:
-			if withinRange(f.CreationTime):
+			if withinRange(f.CreationTime, 'CreationTime'):
 				msg += "\t\tCreationTime: "+str(f.CreationTime)+" - within range\n"
 				pass
 			else:
 				msg += "\t\tCreationTime: "+str(f.CreationTime)+" outside range\n"
 				
 		if f.ModifyTime is not None:
-			if withinRange(f.ModifyTime):	
+			if withinRange(f.ModifyTime, 'ModifyTime'):	
 				msg += "\t\tModifyTime: "+str(f.ModifyTime)+" within range\n"
 				pass
 			else:
 				msg += "\t\tModifyTime: "+str(f.ModifyTime)+" outside range\n"
 
 		if f.AccessTime is not None:
-			if withinRange(f.AccessTime):	
+			if withinRange(f.AccessTime, 'AccessTime'):	
 				msg += "\t\tAccessTime: "+str(f.AccessTime)+" within range\n"
 				pass
 			else:
 				msg += "\t\tAccessTime: "+str(f.AccessTime)+" outside range\n"
 				
 		if f.DeletedTime is not None:
-			if withinRange(f.DeletedTime):
+			if withinRange(f.DeletedTime, 'DeletedTime'):
 				msg += "\t\tDeletedTime: "+str(f.DeletedTime)+" within range\n"
 				pass
 			else:
@@ -237,13 +1953,13 @@ def containsTimeStamp_DataFiles(f) :
 							hr = '00'
 						t_str = str(yyyy)+'-'+str(mm)+'-'+str(dd)+' '+str(hr)+':'+str(mn)+':'+str(sec)
 						
-						ts = TimeStamp(System.Convert.ToDateTime(t_str))
+						ticks = normalizeTicks(int(yyyy), int(mm), int(dd), int(hr), int(mn), int(float(sec)))
 						
-						if withinRange(ts):
+						if withinRangeTicks(ticks, 'EXIFCaptureTime'):
 							
-							msg += "\t\tEXIFCaptureTime: "+str(ts)+" within range\n"
+							msg += "\t\tEXIFCaptureTime: "+t_str+" within range\n"
 						else:
-							msg += "\t\tEXIFCaptureTime: "+str(ts)+" outside range\n"
+							msg += "\t\tEXIFCaptureTime: "+t_str+" outside range\n"
 						
 					
 					if mdf.Name == 'DateTime' and mdf.Value is not None:
@@ -264,15 +1980,53 @@ def containsTimeStamp_DataFiles(f) :
 						# or 7:44:36 AM(UTC+0) (EXIF DateTime are usually stored as local time)
 						hr = hr.replace("24", "0")
 						t_str = yyyy+'-'+mm+'-'+dd+' '+str(hr)+':'+mn+':'+sec+utc_offset
-						ts = TimeStamp(System.Convert.ToDateTime(t_str))
-						if withinRange(ts):
-							msg += "\t\tCaptureTime: "+str(ts)+" within range\n"
+						# '12:00:00.5+02:00' and '12:00:00Z'
+						zone = FRACTIONAL_SECONDS.sub('', utc_offset).strip()
+						if zone.upper() == 'Z':
+							zone = '+00:00'
+						if zone == '':
+							ticks = normalizeTicks(int(yyyy), int(mm), int(dd), int(hr), int(mn), int(float(sec)))
+						elif offsetTicks(zone) is not None:
+							ticks = normalizeTicks(int(yyyy), int(mm), int(dd), int(hr), int(mn), int(float(sec)), offsetTicks(zone))
 						else:
-							msg += "\t\tCaptureTime: "+str(ts)+" outside range\n"
+							# any other form is left to .NET, as before the offset table
+							ticks = toTicks(TimeStamp(System.Convert.ToDateTime(t_str), True))
+							if ticks is None:
+								raise ValueError("unknown UTC offset "+utc_offset)
+						if withinRangeTicks(ticks, 'DateTime'):
+							msg += "\t\tCaptureTime: "+t_str+" within range\n"
+						else:
+							msg += "\t\tCaptureTime: "+t_str+" outside range\n"
 		except Exception as e:
 			msg = "Error EXIFCaptureTime "+str(e)
 			print (currentFile.encode('utf8')+":"+msg)
 			debug(msg, 'EXIFCaptureTime error')
+
+		if not deleted_kept and needs_exif_fallback(f):
+			key = file_key(f)
+			if key in exif_fallback_results:
+				ticks = exif_fallback_results[key]
+			else:
+				ticks = read_exif_fallback(f)
+			if ticks is not None:
+				if withinRangeTicks(ticks, 'EXIFDateTimeOriginal'):
+					msg += "\t\tEXIF header DateTimeOriginal: "+str(ticks)+" ticks within range\n"
+				else:
+					msg += "\t\tEXIF header DateTimeOriginal: "+str(ticks)+" ticks outside range\n"
+
+		try:
+			if not deleted_kept and needs_container_timestamps(f):
+				creation, modification = read_container_timestamps(f)
+				for field, ticks in [('mvhdCreationTime', creation), ('mvhdModificationTime', modification)]:
+					if ticks is None:
+						continue
+					if withinRangeTicks(ticks, field):
+						msg += "\t\t"+field+": "+str(ticks)+" ticks within range\n"
+					else:
+						msg += "\t\t"+field+": "+str(ticks)+" ticks outside range\n"
+		except Exception as e:
+			msg += "\t\tError reading container timestamps "+str(e)+"\n"
+			print (currentFile.encode('utf8')+": Error reading container timestamps "+str(e))
 		
 		if global_inside_timeframe is True:
 			keep = True
@@ -286,147 +2040,366 @@ def containsTimeStamp_DataFiles(f) :
 	return keep	
 	
 
+# Data File of a category that is entirely outside the date range.
+# Same verdict as containsTimeStamp_DataFiles() without evaluating each timestamp.
+# Files with container or EXIF fallback timestamps are checked in full: those
+# are read from the file, not from the filesystem times.
+def containsTimeStamp_DataFiles_outsideSpan(f):
+	if f.Deleted is not None:
+		if doNotDateFilterDeleted is True and (str(f.Deleted) == "Deleted"):
+			debug("\t\tKeeping deleted Data File "+str(f.Name), 'DataFiles Processing error writing log')
+			return True
+	if needs_container_timestamps(f) or needs_exif_fallback(f):
+		return containsTimeStamp_DataFiles(f)
+	for ts in [f.CreationTime, f.ModifyTime, f.AccessTime, f.DeletedTime]:
+		if ts is not None:
+			return False
+	# Only EXIF timestamps left. These may fail to parse so check them.
+	return containsTimeStamp_DataFiles(f)
+
+
 	
 # Filters Data Files by dates and clears non-matches
+# The Data Files of PA 5.3 and PA 5.4+ both come from iter_DataFiles()
 def filter_DataFiles():
 	global nRemoved
 	global currentFile
-	tagslisttoClear = []
+	tagslisttoClear = verdicts['DataFiles']
 	msg = ''
 	
 	msg2 = "Date range start="+str(dt_start)+" end="+str(dt_end)
 	print (msg2)
-	for category in ds.TaggedFiles:
+	attachments_resolve()
+	for key, category_files in iter_DataFiles():
 		msg1 = "\n***********************************\n"
-		msg1 += "Processing "+category.Name
+		cn, name = datafile_category_info(key)
+		skip = resume_from('DataFiles', cn)
+		if skip is None:
+			continue
+		msg1 += "Processing "+cn
 		print(msg1)
 
+		log.set_category(cn)
 		debug(msg1+"\n", "error writing data files log")
-		filenum = 1
-		cn = str(category.Name)
-		cnlist = cn.split('.')
-		name = cnlist[-1]
-		for f in list(ds.TaggedFiles[category.Name]):
+		snapshot_set_category(cn)
+		sanity_set_category(cn)
+		timeline_set_category(cn)
+		identity_set_category(cn)
+		files = list(category_files)
+		span = category_span(cn, len(files))
+		filenum = skip+1
+		files = files[skip:]
+		if span == SPAN_INSIDE:
+			msg = str(name)+'(s) all within date range in previous snapshot. Keeping: '+str(len(files))
+			print(msg)
+			debug(msg, 'Data Files finish category error writing log')
+			audit_items_kept(cn, files, 'span-inside', skip, file_key)
+			continue
+		elif span == SPAN_OUTSIDE:
+			msg = str(name)+'(s) all outside date range in previous snapshot'
+			print(msg)
+			debug(msg, 'Data Files category error writing log')
+		exif_fallback_prefetch(files)
+		for f in files:
 			msg = "\n"+name+" "+str(filenum)+": "
 			
 			# fixed runtime error with malformed names
 
 			
+			# Names are unicode. debug() does the utf-8 encoding.
 			if f.Name is not None:
-				try:
-					if f.Name.isunicode:
-						ustr = f.Name.encode('utf-8', 'ignore')
-						msg += ustr
-						currentFile = ustr
-					else:
-						msg += str(f.Name)
-						currentFile = str(f.Name)
-				except UnicodeEncodeError as e:
-					msg += "UnicodeEncodeError: bad filename"
+				currentFile = f.Name
+				msg += currentFile
 			
 			debug(msg, "Data Files processing error writing log")
 
 				
-			if (containsTimeStamp_DataFiles(f)):
+			deleted = str(f.Deleted) == "Deleted"
+			if span == SPAN_OUTSIDE:
+				keep_file = containsTimeStamp_DataFiles_outsideSpan(f)
+			else:
+				snapshot_begin_item()
+				keep_file = containsTimeStamp_DataFiles(f)
+				snapshot_end_item(deleted)
+			item_id = item_identity(cn, file_key(f))
+			rule = audit_rule(keep_file, deleted, span)
+			own_timestamps = global_inside_timeframe is True or (deleted and doNotDateFilterDeleted is True)
+			keep_file, rule = attachment_verdict(f, keep_file, rule, own_timestamps)
+			if (keep_file):
 				msg = "\t\tKeeping"
 				pass
 			else:
-				tagslisttoClear.append(f)
+				tagslisttoClear.append((cn, filenum-1, item_id, f))
 				msg = "\t\tRemoving"
+			audit_item(cn, filenum-1, item_id, keep_file, rule)
 			#print(msg)
 			debug(msg, "Error writing log data files")
+			checkpoint('DataFiles', cn, filenum, f)
 			filenum += 1
 			currentFile = ''
+		exif_fallback_results.clear()
 		msg = str(name)+'(s) Processed: '+str(filenum-1)
 		print(msg)
 		debug(msg, 'Data Files finish category error writing log')
 	
-	# Remove data files from PA list
 	nRemoved = len(tagslisttoClear)
-	for f in tagslisttoClear:
-		f.Tags.Clear()
-		
 	print "\n***********************************"
 	msg = "Data Files removed = "+str(nRemoved)
 	print (msg)
 	debug(msg, 'Error writing log Data Files removed')
+	if attachments_kept > 0 or attachments_orphaned > 0:
+		msg = "Attachments: kept "+str(attachments_kept)+" Data Files of kept items, removed "+str(attachments_orphaned)+" only attached to removed items"
+		print(msg)
+		debug(msg, 'Error writing log attachments')
 	return nRemoved
 
 
-# Since PA v5.4, ds.DataFiles is used for Graphics
-def filter_DataFiles_v5_4():
-	global nRemoved
-	global currentFile
-	tagslisttoClear = []
-	msg = ''
-	
-	msg2 = "Date range start="+str(dt_start)+" end="+str(dt_end)
-	print (msg2)
-	for category in ds.DataFiles:
-		msg1 = "\n***********************************\n"
-		msg1 += "Processing "+category.Key
-		print(msg1)
-
-		debug(msg1+"\n", "error writing data files log")
-		filenum = 1
-		cn = str(category.Key)
-		cnlist = cn.split('.')
-		name = cnlist[-1]
-		for f in list(ds.DataFiles[category.Key]):
-			msg = "\n"+name+" "+str(filenum)+": "
-			
-			# fixed runtime error with malformed names
-
-			
-			if f.Name is not None:
-				try:
-					if f.Name.isunicode:
-						ustr = f.Name.encode('utf-8', 'ignore')
-						msg += ustr
-						currentFile = ustr
-					else:
-						msg += str(f.Name)
-						currentFile = str(f.Name)
-				except UnicodeEncodeError as e:
-					msg += "UnicodeEncodeError: bad filename"
-			
-			debug(msg, "Data Files processing error writing log")
-
-				
-			if (containsTimeStamp_DataFiles(f)):
-				msg = "\t\tKeeping"
-				pass
-			else:
-				tagslisttoClear.append(f)
-				msg = "\t\tRemoving"
-			#print(msg)
-			debug(msg, "Error writing log data files")
-			filenum += 1
-			currentFile = ''
-		msg = str(name)+'(s) Processed: '+str(filenum-1)
-		print(msg)
-		debug(msg, 'Data Files finish category error writing log')
-	
-	# Remove data files from PA list
-	nRemoved = len(tagslisttoClear)
-	for f in tagslisttoClear:
-		f.Tags.Clear()
-		
-	print "\n***********************************"
-	msg = "Data Files removed = "+str(nRemoved)
-	print (msg)
-	debug(msg, 'Error writing log Data Files removed')
-	return nRemoved
-	
 def reset_globals():
 	global global_all_timestamps_None
 	global global_inside_timeframe
 	global keep
 	global nRemoved
+	global item_ticks
+	global sanity_item_flagged
 	global_all_timestamps_None = True
 	global_inside_timeframe  = False
 	keep = False
 	nRemoved = 0
+	item_ticks = []
+	sanity_item_flagged = False
+
+# Chat envelope
+# If a chat's StartTime and LastActivity are both within the date range, a
+# message of the chat whose TimeStamp lies between them has a timestamp
+# within the range and is kept, without evaluating its other timestamps.
+# Nothing guarantees that every message lies within its chat's envelope, so
+# messages without a TimeStamp, or with one outside the envelope, are
+# checked one by one like those of any other chat. Deleted messages may
+# carry timestamps outside of the envelope, so the envelope is only used
+# when deleted data is not date filtered, and not with sanityCheckTimestamps,
+# which may treat a timestamp within the envelope as missing.
+# Chats that straddle the range, or are outside of it, are checked message
+# by message. Kept messages are not in the snapshot. When the audit or the
+# attachment index needs their identity, it is computed from message_key(),
+# the same key a message of a straddling chat gets, so a message keeps its
+# identity whatever the date range.
+useChatEnvelope = True
+
+envelope_chats = 0
+envelope_messages = 0
+
+# (StartTime, LastActivity) of chat f if both are within the date range, else None
+def chat_envelope_inside(f):
+	if useChatEnvelope is not True or doNotDateFilterDeleted is not True or sanityCheckTimestamps is True:
+		return None
+	try:
+		start = f.StartTime.Value
+		last = f.LastActivity.Value
+	except Exception:
+		return None
+	if start is None or last is None:
+		return None
+	if start >= dt_start and last <= dt_end:
+		return (start, last)
+	return None
+
+
+# True if message im of a chat with the envelope (start, last) has its TimeStamp within it
+def chat_envelope_keeps(im, envelope):
+	try:
+		ts = im.TimeStamp.Value
+	except Exception:
+		return False
+	return ts is not None and envelope[0] <= ts <= envelope[1]
+
+
+# Attachments
+# MMS, Email and Chat attachments are Data Files as well, which are filtered
+# by their own timestamps. While Analyzed Data is traversed, the attachments
+# of every item are indexed by the path of the file they refer to (the
+# AbsolutePath of their file node, else a Filename or URL with a directory)
+# with the identities of the items that reference them and whether they
+# were kept. A bare file name such as IMG_0001.JPG is not indexed: it would
+# join every Data File of that name in the extraction.
+# Data Files are filtered after Analyzed Data. A Data File matches a path of
+# the index that is its AbsolutePath or ends it at a directory (the path an
+# app stored may lack the partition prefix). A path that matches more than
+# one Data File is ambiguous and not applied. Otherwise:
+#   a file attached to a kept item is kept (rule 'attachment'),
+#   a file without timestamps of its own that is only attached to removed
+#   items is removed with them (rule 'orphan-attachment').
+# The snapshot only has the files' own timestamps, so PA_date_filter_offline.py
+# does not apply this.
+keepAttachmentsWithItems = True
+# Attachment fields that may refer to the attached file, in order
+ATTACHMENT_REFERENCE_FIELDS = ['Data', 'Filename', 'URL']
+
+# path: [[item identity, kept], ...]
+attachment_index = {}
+# path: number of Data Files it matches, counted by attachments_resolve()
+attachment_matches = {}
+# category: True if its items have an Attachments field
+attachment_categories = {}
+attachments_kept = 0
+attachments_orphaned = 0
+
+def attachments_begin():
+	global attachment_index
+	global attachment_matches
+	global attachment_categories
+	global attachments_kept
+	global attachments_orphaned
+	attachment_index = {}
+	attachment_matches = {}
+	attachment_categories = {}
+	attachments_kept = 0
+	attachments_orphaned = 0
+
+
+def has_attachments(category, item):
+	if category not in attachment_categories:
+		try:
+			attachment_categories[category] = item.FieldExists('Attachments')
+		except Exception:
+			attachment_categories[category] = False
+	return attachment_categories[category]
+
+
+def attachment_path(path):
+	return path.replace('\\', '/').strip('/')
+
+
+# Path of the file attachment a refers to, None if it only has a file name
+def attachment_reference(a):
+	for name in ATTACHMENT_REFERENCE_FIELDS:
+		try:
+			value = getattr(a, name).Value
+		except Exception:
+			continue
+		value = getattr(value, 'AbsolutePath', value)
+		if isinstance(value, basestring):
+			path = attachment_path(value)
+			if '/' in path:
+				return path
+	return None
+
+
+# Paths of the index Data File f may match: its AbsolutePath and each of its
+# endings at a directory, longest first. None without an AbsolutePath.
+def attachment_candidates(f):
+	path = getattr(f, 'AbsolutePath', None)
+	if not path:
+		return None
+	parts = attachment_path(path).split('/')
+	return ['/'.join(parts[i:]) for i in range(len(parts)-1)]
+
+
+# Adds the attachments of item f to the index
+def index_attachments(category, f, item_id, kept):
+	if keepAttachmentsWithItems is not True or not has_attachments(category, f):
+		return
+	try:
+		for a in f.Attachments:
+			path = attachment_reference(a)
+			if path:
+				attachment_index.setdefault(path, []).append([item_id, kept])
+	except Exception as e:
+		debug("\t\tAttachments error: "+str(e), 'attachments error writing log')
+
+
+# Counts the Data Files each path of the index matches, before filter_DataFiles()
+def attachments_resolve():
+	global attachment_matches
+	attachment_matches = {}
+	if len(attachment_index) == 0:
+		return
+	for key, category_files in iter_DataFiles():
+		for f in category_files:
+			for path in attachment_candidates(f) or []:
+				if path in attachment_index:
+					attachment_matches[path] = attachment_matches.get(path, 0) + 1
+	ambiguous = len([n for n in attachment_matches.values() if n > 1])
+	if ambiguous > 0:
+		msg = "Attachments: "+str(ambiguous)+" attachment paths match more than one Data File and are not applied"
+		print(msg)
+		debug(msg, 'attachments error writing log')
+
+
+# Verdict of Data File f given the items it is attached to.
+# 'own_timestamps' is False if f was kept without a timestamp of its own.
+def attachment_verdict(f, keep_file, rule, own_timestamps):
+	global attachments_kept
+	global attachments_orphaned
+	if len(attachment_index) == 0:
+		return keep_file, rule
+	refs = None
+	for path in attachment_candidates(f) or []:
+		if path in attachment_index:
+			if attachment_matches.get(path, 0) != 1:
+				debug("\t\tAmbiguous attachment path "+path+", not applied", 'attachments error writing log')
+				return keep_file, rule
+			refs = attachment_index[path]
+			break
+	if refs is None:
+		return keep_file, rule
+	for item_id, kept in refs:
+		if kept:
+			if not keep_file:
+				attachments_kept += 1
+				debug("\t\tAttachment of kept item "+item_id, 'attachments error writing log')
+				return True, 'attachment'
+			return keep_file, rule
+	if keep_file and not own_timestamps:
+		attachments_orphaned += 1
+		debug("\t\tOnly attached to removed items, "+refs[0][0]+" ...", 'attachments error writing log')
+		return False, 'orphan-attachment'
+	return keep_file, rule
+
+
+# Timestamp fields that hold a collection of timestamps (Value.Value of each entry)
+COLLECTION_TIMEFIELDS = set(['AllTimeStamps'])
+
+# Evaluates the collection timestamp field tf of item f in one pass and
+# returns a one line summary for the log. Stops at the first entry within
+# range, unless the snapshot needs every timestamp of the item.
+# Collection timestamps are not part of the item identity, so the identity
+# does not depend on where the evaluation stopped.
+def withinRange_collection(f, tf):
+	n = 0
+	outside = 0
+	first_within = None
+	nticks = len(item_ticks)
+	for ts in getattr(f, tf):
+		n += 1
+		value = ts.Value.Value
+		if withinRange(value, tf):
+			if first_within is None:
+				first_within = value
+				if snapshot_item_ticks is None:
+					break
+		else:
+			outside += 1
+	del item_ticks[nticks:]
+	if n == 0:
+		return "\t\t"+tf+": none\n"
+	if first_within is not None:
+		return "\t\t"+tf+": "+str(first_within)+" within ("+str(n)+" checked)\n"
+	return "\t\t"+tf+": "+str(outside)+" of "+str(n)+" outside\n"
+
+
+# True if any of the timefields of Analyzed Data item f has a value
+def hasTimeStamp_Model(f, timefields):
+	for tf in timefields:
+		try:
+			if tf == "AllTimeStamps":
+				for ts in getattr(f, tf):
+					return True
+			elif getattr(f, tf).Value is not None:
+				return True
+		except Exception as e:
+			pass
+	return False
+
 
 def filter_AnalyzedData2():
 	"""
@@ -438,113 +2411,130 @@ def filter_AnalyzedData2():
 	Some subcategories will not be updated in GUI.
 	But the reports should show updated data.
 	"""
-	listtoClear = []
-	chats_Messages_listtoClear = []
+	listtoClear = verdicts['Models']
+	chats_Messages_listtoClear = verdicts['Messages']
 	global keep
 	global log
+	global envelope_chats
+	global envelope_messages
 	msg = ''
+	envelope_chats = 0
+	envelope_messages = 0
 
-	# 35 TimeStamps. Duration removed. AllTimeStamps may need review.
-	# 
-	# update 2017-03-08  PA 5.4's Voicemail field has 'Timestamp' field instead of 'TimeStamp'.  Notice the lower case 's'.
-	timefields = [
-				'TimeContacted', 
-				'TimeCreated', 
-				'TimeModified',
-				'TimeLastLoggedIn',
-				'DateDelivered',
-				'DateRead',
-				'DatePlayed',
-				'TimeStamp',
-				'Timestamp',
-				'AllTimeStamps',
-				'StartTime',
-				'LastActivity',
-				'Creation',
-				'Modification',
-				'StartDate',
-				'EndDate',
-				'Reminder',
-				'RepeatUntil',
-				'EndTime',
-				'Expiry',
-				'CreationTime',
-				'LastAccessTime',
-				'LastVisited',
-				'LastConnected',
-				'LastConnection',
-				'LastAutoConnection',
-				'PurchaseDate',
-				'DeletedDate',
-				'Date',
-				'LastLaunch',
-				'PurchaseTime',
-				'ModifyTime',
-				'ActivationTime',
-				'ExpirationTime',
-				]
-	
-	if doNotFilterContact_by_LastContacted is True:
-		# Assumption: TimeContacted timestamp is only used by Contacts.
-		# Currently this is true. If other categories use the TimeContacted timestamp,
-		# this will prevent those categories from being date filtered properly. 
-		timefields.remove('TimeContacted')
-		
 	
 	# For all models
 	for m in list(ds.Models):
 		msg1 = "\n***********************************\n"
-		msg1 += "Processing "+str(m.ModelType)
+		cn, mtype, cn_messages = model_type_info(m.ModelType)
+		skip = resume_from('AnalyzedData', cn)
+		if skip is None:
+			continue
+		msg1 += "Processing "+cn
 		msg2 = "\tdaterange start: "+str(dt_start)+" end: "+str(dt_end)
 		msg2 += "\n***********************************\n"
 		msg = msg1+"\n"+msg2
+		log.set_category(cn)
 		debug(msg, "Data Models Error writing log")
 		reset_globals()
 
-		filenum = 1
-		cn = str(m.ModelType)
-		cnlist = cn.split('.')
-		mtype = cnlist[-1]
-		
-		
-		if str(m.ModelType) == 'Data.Models.ContactModels.Contact':
-			if doNotFilterContact_by_LastContacted is True:
-				# skip all Data.Models.ContactModels.Contact
-				continue 
+		# skip all Data.Models.ContactModels.Contact if not filtering by LastContacted
+		identity_set_category(cn, cn_messages)
+		if m.ModelType in skipped_model_types:
+			items = list(ds.Models[m.ModelType])
+			audit_items_kept(cn, items, 'exempt', 0, lambda f: model_key(f, []))
+			continue 
 
 		# For all data of a model type
-		for f in ds.Models[m.ModelType]:
-			msg = "\t"+str(mtype)+" File "+str(filenum)
+		snapshot_set_category(cn)
+		sanity_set_category(cn)
+		timeline_set_category(cn)
+		items = list(ds.Models[m.ModelType])
+		if len(items) == 0:
+			continue
+		timefields = model_fields(m.ModelType, items[0])
+		getters = model_getters(m.ModelType, items[0])
+		span = category_span(cn, len(items))
+		filenum = skip+1
+		items = items[skip:]
+		if span == SPAN_INSIDE:
+			msg = "\t"+mtype+": all within date range in previous snapshot. Keeping: "+str(len(items))
+			debug(msg, "Processing Models - error writing log")
+			key = lambda f: model_key(f, timefields)
+			audit_items_kept(cn, items, 'span-inside', skip, key)
+			continue
+		elif span == SPAN_OUTSIDE:
+			msg = "\t"+mtype+": all outside date range in previous snapshot"
+			debug(msg, "Processing Models - error writing log")
+			for f in items:
+				msg = "\t"+mtype+" File "+str(filenum)
+				item_id = item_identity(cn, model_key(f, timefields))
+				if f.Deleted is not None and doNotDateFilterDeleted is True and (str(f.Deleted) == 'Deleted'):
+					msg += "\n\t\tKeeping Deleted File"
+					audit_item(cn, filenum-1, item_id, True, 'deleted')
+					index_attachments(cn, f, item_id, True)
+				elif hasTimeStamp_Model(f, timefields):
+					msg += "\n\t\tRemoving"
+					listtoClear.append((cn, filenum-1, item_id, f))
+					audit_item(cn, filenum-1, item_id, False, 'span-outside')
+					index_attachments(cn, f, item_id, False)
+				else:
+					msg += "\n\t\tKeeping"
+					audit_item(cn, filenum-1, item_id, True, 'no-timestamps')
+					index_attachments(cn, f, item_id, True)
+				debug(msg, "Keeping data error writing log")
+				checkpoint('AnalyzedData', cn, filenum, f, m.ModelType)
+				filenum += 1
+			continue
+		for f in items:
+			msg = "\t"+mtype+" File "+str(filenum)
 			debug(msg, "Processing Models - error writing log")
 			#if f == Data.Models.Chat:
 			if f.FieldExists('Messages'):
 				im_num = 1
+				snapshot_set_category(cn_messages)
+				sanity_set_category(cn_messages)
+				timeline_set_category(cn_messages)
+				enveloped = chat_envelope_inside(f)
+				if enveloped is not None:
+					envelope_chats += 1
+					debug("\t\tChat within date range from StartTime to LastActivity. Keeping the IMs with a TimeStamp within it", "error writing log IM")
 				for im in f.Messages:
+					if enveloped is not None and chat_envelope_keeps(im, enveloped):
+						if audit is not None or (keepAttachmentsWithItems is True and has_attachments(cn_messages, im)):
+							im_index = str(filenum-1)+"/"+str(im_num-1)
+							item_id = item_identity(cn_messages, message_key(im))
+							audit_item(cn_messages, im_index, item_id, True, 'chat-envelope')
+							index_attachments(cn_messages, im, item_id, True)
+						snapshot_skip_item(cn_messages)
+						envelope_messages += 1
+						im_num+=1
+						continue
 					msg = "\t\tChat IM "+str(im_num)+"\n"
+					snapshot_begin_item()
 					try:
 						# 2017-03-16 handle cases when chat timestamps are empty and pass im.<TimeField>.Value to withinRange()
 						if im.FieldExists('TimeStamp') and im.TimeStamp.Value is not None:
-							if withinRange(im.TimeStamp.Value):
+							if withinRange(im.TimeStamp.Value, 'TimeStamp'):
 								msg += "\t\t\t TimeStamp "+str(im.TimeStamp)+" within"
 								pass
 						if im.FieldExists('StartTime') and im.StartTime.Value is not None:
-							if withinRange(im.StartTime.Value):
+							if withinRange(im.StartTime.Value, 'StartTime'):
 								msg += "\t\t\t StartTime "+str(im.StartTime)+" within"
 								pass
 						if im.FieldExists('DateDelivered') and im.DateDelivered.Value is not None:
-							if withinRange(im.DateDelivered.Value):
+							if withinRange(im.DateDelivered.Value, 'DateDelivered'):
 								msg += "\t\t\t DateDelivered"+str(im.DateDelivered)+" within"
 								pass
 						if im.FieldExists('DateRead') and im.DateRead.Value is not None:
-							if withinRange(im.DateRead.Value):
+							if withinRange(im.DateRead.Value, 'DateRead'):
 								msg += "\t\t\t DateRead"+str(im.DateRead)+" within"
 								pass
 						if im.FieldExists('DatePlayed') and im.DatePlayed.Value is not None:
-							if withinRange(im.DatePlayed.Value):
+							if withinRange(im.DatePlayed.Value, 'DatePlayed'):
 								msg += "\t\t\t DatePlayed"+str(im.DatePlayed)+" within"
 								pass
 						if im.FieldExists('Date') and im.Date.Value is not None:
-							if withinRange(im.Date.Value):
+							if withinRange(im.Date.Value, 'Date'):
 								msg += "\t\t\t Date"+str(im.Date)+" within"
 								pass
 					except Exception as e:
@@ -568,14 +2558,22 @@ def filter_AnalyzedData2():
 							debug(msg, "Keeping Deleted Chat IM error writing log")
 							keep = True
 						
+					im_index = str(filenum-1)+"/"+str(im_num-1)
+					item_id = item_identity(cn_messages, source=model_source(im))
 					if keep is True:
 						msg += "\t\t\tKeeping"
 					else:
-						chats_Messages_listtoClear.append(im)
+						chats_Messages_listtoClear.append((cn, filenum-1, im_num-1, item_id, im))
 						msg += "\t\t\tRemoving"
+					audit_item(cn_messages, im_index, item_id, keep, audit_rule(keep, str(im.Deleted) == "Deleted"))
+					index_attachments(cn_messages, im, item_id, keep)
 					debug(msg,"error writing log IM")
+					snapshot_end_item(str(im.Deleted) == "Deleted")
 					reset_globals()
 					im_num+=1
+				snapshot_set_category(cn)
+				sanity_set_category(cn)
+				timeline_set_category(cn)
 
 			# FieldExists('Deleted') does not work as expected
 			# maybe because all Models are known to have a Deleted field?
@@ -588,22 +2586,21 @@ def filter_AnalyzedData2():
 					keep = True
 			
 			msg = ''
+			snapshot_begin_item()
 			# scan through all possible timefield timestamps
-			for tf in timefields:
+			for tf, get_value in getters:
 				# AllTimeStamps gets special handling... Value.Value to get right type
-				if tf is "AllTimeStamps" and f.FieldExists(tf):
-					for ts in getattr(f, tf):
-						if withinRange(ts.Value.Value):
-							msg += "\t\tAllTimeStamp="+str(ts.Value.Value)+" within\n"
-						else:
-							msg += '\t\tAllTimeStamp='+str(ts.Value.Value)+" outside\n"
-						debug(msg, "SMS AllTimeStamp error writing log")
+				if tf in COLLECTION_TIMEFIELDS:
+					msg += withinRange_collection(f, tf)
 			
-				elif f.FieldExists(tf):
+				else:
 					try:
-						ts_val = getattr(f, tf).Value
+						if get_value is None:
+							ts_val = getattr(f, tf).Value
+						else:
+							ts_val = get_value(f)
 						if ts_val is not None:
-							if withinRange(ts_val):
+							if withinRange(ts_val, tf):
 								msg += "\t\t"+str(tf)+":"+str(ts_val)+" within\n"
 								pass
 							else:
@@ -618,14 +2615,19 @@ def filter_AnalyzedData2():
 			if global_all_timestamps_None is True:
 				# There were no timestamps or all timestamps were blank
 				keep = True
+			item_id = item_identity(cn, source=model_source(f))
 			if keep is True:
 				msg += "\t\tKeeping\n"
 			else:
 				msg += "\t\tRemoving\n"
-				listtoClear.append(f)
+				listtoClear.append((cn, filenum-1, item_id, f))
+			audit_item(cn, filenum-1, item_id, keep, audit_rule(keep, str(f.Deleted) == 'Deleted'))
+			index_attachments(cn, f, item_id, keep)
+			snapshot_end_item(str(f.Deleted) == 'Deleted')
 				
 			#print(msg)
 			debug(msg, "Keeping data error writing log")
+			checkpoint('AnalyzedData', cn, filenum, f, m.ModelType)
 			
 			filenum += 1
 			reset_globals()	
@@ -639,27 +2641,19 @@ def filter_AnalyzedData2():
 	msg = msg1+" "+msg2
 	print(msg)
 	debug(msg, "Error writing log, total Analyzed Data removed")
-
-	
-	# Remove items from PA GUI
-	n = c = 0 
-	for f in listtoClear:
-		if f.ModelCollection is not None:
-			f.ModelCollection.Remove(f)
-			n+=1
-	for f in chats_Messages_listtoClear:
-		if f.ModelCollection is not None:
-			f.ModelCollection.Remove(f)
-			c+=1
-	
-	print "nRemoved="+str(nRemoved)
-	print "cleared chats = "+str(c)
-	print "cleared files = "+str(n)
+	if envelope_chats > 0:
+		msg = "Chat envelope kept "+str(envelope_messages)+" Instant Messages of "+str(envelope_chats)+" chats by their TimeStamp alone"
+		print(msg)
+		debug(msg, "Error writing log, chat envelope")
 	return nRemoved
 		
 		
+# Items filter_AnalyzedData() would remove are collected here instead of
+# being removed while run_oracle() runs it. None otherwise.
+legacy_removed = None
+
 # Filters all Analyzed Data. It will update the PA GUI.
-# Old version of filter logic. This def is not called currently.
+# Old version of filter logic. This def is not called currently, except by run_oracle().
 # It is still useful to see what timestamps are looked for in each category.
 def filter_AnalyzedData():
 	"""
@@ -771,7 +2765,8 @@ def filter_AnalyzedData():
 						pass
 				# errors with f.AllTimeStamps.Value
 				if f.AllTimeStamps is not None or f.AllTimeStamps is not '':
-					MessageBox.Show('Detected SMS AllTimeStamps field. Please reopen phone dump and check manually.')
+					if legacy_removed is None:
+						MessageBox.Show('Detected SMS AllTimeStamps field. Please reopen phone dump and check manually.')
 					for i in list(f.AllTimeStamps):
 						msg = "\tSMS.AllTimeStamps found. Manual check needed..."
 						print(msg)
@@ -1409,6 +3404,10 @@ def filter_AnalyzedData():
 	print("Analyzed Data items - others - removed ="+str(len(listtoClear)))
 	global nRemoved
 	nRemoved = len(listtoClear)+len(chats_Messages_listtoClear)
+	if legacy_removed is not None:
+		legacy_removed.extend(listtoClear)
+		legacy_removed.extend(chats_Messages_listtoClear)
+		return nRemoved
 	
 	# Remove items from PA GUI
 	for f in listtoClear:
@@ -1418,65 +3417,1235 @@ def filter_AnalyzedData():
 	return nRemoved	
 
 
-# Filters Data Files by dates and clears non-matches
-def filter_DeviceInfo():
-	global nRemoved
-	listtoClear = []
-	msg = ''
-	ts_count = 1
-	
-	msg1 = "\n***********************************\n"
-	msg1 += "Processing DeviceInfo data"
-	print(msg1)
-	debug(msg1+"\n", "error writing DeviceInfo log")
-	
-	msg2 = "Date range start="+str(dt_start)+" end="+str(dt_end)
-	print (msg2)
-	debug(msg2+"\n", "error writing DeviceInfo log")
-	
-	for i in ds.DeviceInfo:
-		
-		if i.Name == 'DeviceInfoLocalNetworkIP' or i.Name == 'DeviceInfoInternetNetworkIP':
-			dt_val = None
-			m = re.match(".* at (....-..-.. ..:..:..).*", i.Value)
-			if m:
-				msg = "DeviceInfo item ("+str(ts_count)+"): "+str( m.group(0) )
-				utc = re.search("UTC", m.group(0))
-				if utc:
-					msg += "\n\t\tTimestamp: "+str( m.group(1) )
-					dt_val = TimeStamp(System.Convert.ToDateTime( m.group(1) ), True)
-				else:
-					msg += "\n\t\tTimestamp: "+str( m.group(1) )
-					msg += " 'UTC' offset not found. Treating as UTC time."
-					ts_w_utc = str(m.group(1))+"-0"
-					dt_val = TimeStamp(System.Convert.ToDateTime( ts_w_utc ), True)	
-			if withinRange(dt_val):
-				msg += " within range.\n\t\tKeeping"
-			else:
-				listtoClear.append(i)
-				msg += " outside range.\n\t\tRemoving"
-			#print(msg)
-			debug(msg, "Error writing log data files")
-		ts_count += 1
+# DeviceInfo network history entries: "<address> at yyyy-mm-dd hh:mm:ss [UTC]"
+DEVICEINFO_TIMESTAMP_NAMES = set(['DeviceInfoLocalNetworkIP', 'DeviceInfoInternetNetworkIP'])
+DEVICEINFO_TIMESTAMP = re.compile(r' at (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)')
+
+# Filters DeviceInfo entries by dates and removes non-matches.
+# Their timestamps are UTC, with or without 'UTC' in the value.
+def filter_DeviceInfo():
+	global nRemoved
+	listtoClear = verdicts['DeviceInfo']
+	msg = ''
+	skip = resume_from('DeviceInfo', 'DeviceInfo')
+	if skip is None:
+		skip = 0
+	ts_count = skip+1
+	
+	msg1 = "\n***********************************\n"
+	msg1 += "Processing DeviceInfo data"
+	print(msg1)
+	log.set_category('DeviceInfo')
+	debug(msg1+"\n", "error writing DeviceInfo log")
+	
+	msg2 = "Date range start="+str(dt_start)+" end="+str(dt_end)
+	print (msg2)
+	debug(msg2+"\n", "error writing DeviceInfo log")
+	identity_set_category('DeviceInfo')
+	
+	for i in list(ds.DeviceInfo)[skip:]:
+		
+		if i.Name in DEVICEINFO_TIMESTAMP_NAMES:
+			value = i.Value
+			if value is None:
+				value = ''
+			msg = "DeviceInfo item ("+str(ts_count)+"): "+value
+			ticks = None
+			sanity_set_category('DeviceInfo')
+			timeline_set_category('DeviceInfo')
+			m = DEVICEINFO_TIMESTAMP.search(value)
+			if m:
+				msg += "\n\t\tTimestamp: "+m.group(1)
+				ticks = ticksFromString(m.group(1))
+				if 'UTC' not in value:
+					if deviceTimeZone is None:
+						msg += " 'UTC' offset not found. Treating as UTC time."
+					else:
+						msg += " 'UTC' offset not found. Treating as "+deviceTimeZone+" time."
+						if ticks is not None:
+							ticks = localToUtcTicks(ticks)
+				if ticks is not None and timeline_category is not None:
+					timeline_add(ticks)
+				if ticks is not None and sanityCheckTimestamps is True and implausible(ticks):
+					msg += " implausible, treated as None."
+					ticks = None
+			item_id = item_identity('DeviceInfo', i.Name+"="+value)
+			if ticks is None:
+				# no timestamp so we keep the item
+				msg += "\n\t\tNo timestamp.\n\t\tKeeping"
+				audit_item('DeviceInfo', ts_count-1, item_id, True, 'no-timestamps')
+			elif start_ticks <= ticks <= end_ticks:
+				msg += " within range.\n\t\tKeeping"
+				audit_item('DeviceInfo', ts_count-1, item_id, True, 'in-range', i.Name, ticks)
+			else:
+				listtoClear.append((ts_count-1, item_id, i))
+				msg += " outside range.\n\t\tRemoving"
+				audit_item('DeviceInfo', ts_count-1, item_id, False, 'out-of-range', i.Name, ticks)
+			#print(msg)
+			debug(msg, "Error writing log data files")
+		checkpoint('DeviceInfo', 'DeviceInfo', ts_count, i)
+		ts_count += 1
+
+	msg = 'DeviceInfo: Processed '+str(ts_count-1)+' items'
+	print(msg)
+	debug(msg, 'DeviceInfo finish. error writing log')
+	
+	nRemoved = len(listtoClear)
+	print "\n***********************************"
+	msg = "DeviceInfo items removed = "+str(nRemoved)
+	print (msg)
+	debug(msg, 'Error writing log DeviceInfo items removed')
+	return nRemoved
+
+	
+
+# Verdicts of a run: the items to remove, their position in the datastore and identity
+#   'DataFiles': (category, index, identity, file)
+#   'Models': (model type, index, identity, item)
+#   'Messages': (model type, chat index, message index, identity, message)
+#   'DeviceInfo': (index, identity, entry)
+verdicts = None
+
+def new_verdicts():
+	global verdict_digests
+	verdict_digests = {}
+	return {'DataFiles': [], 'Models': [], 'Messages': [], 'DeviceInfo': []}
+
+
+# Verdicts are saved by position (verdict cache, checkpoints) with a digest
+# of the key of their item:
+#   Data Files: file_key()
+#   Analyzed Data: model_key() of the policy fields of its type
+#   chat messages: message_key()
+#   DeviceInfo: name and value
+# A reopened extraction may list a collection in another order with the
+# same counts, so the item found at a saved position is only trusted if it
+# has the same digest.
+# id(item): key digest, for the items of 'verdicts'
+verdict_digests = {}
+
+def item_digest(stage, item, model_type=None):
+	digest = verdict_digests.get(id(item))
+	if digest is None:
+		if stage == 'DataFiles':
+			key = file_key(item)
+		elif stage == 'Models':
+			key = model_key(item, model_fields(model_type, item))
+		elif stage == 'Messages':
+			key = message_key(item)
+		else:
+			key = unicode(item.Name)+"="+unicode(item.Value)
+		digest = hashlib.sha1(unicode(key).encode('utf-8')).hexdigest()[:ITEM_ID_DIGITS]
+		verdict_digests[id(item)] = digest
+	return digest
+
+
+# Removal manifest
+# apply_verdicts() lists every removed item in <log>.removed.txt as a hash
+# chain. After every removalManifestBlockItems item lines a seal line
+#   #<sha256 hex>
+# is written, the SHA-256 of the previous seal's hex digest followed by the
+# UTF-8 bytes of the block's item lines. The first block is chained to the
+# SHA-256 of the REMOVAL_MANIFEST_MAGIC header line. The last seal is the
+# root hash, shown when the run finishes and written to the log.
+# PA_date_filter_verify.py re-checks a manifest in a single pass.
+REMOVAL_MANIFEST_MAGIC = 'PADFRMV1'
+removalManifestBlockItems = 1024
+
+removal_manifest = None
+removal_manifest_digest = ''
+removal_manifest_block = []
+removal_manifest_blocks = 0
+
+def removal_manifest_open(filename, header):
+	global removal_manifest
+	global removal_manifest_digest
+	global removal_manifest_block
+	global removal_manifest_blocks
+	removal_manifest_block = []
+	removal_manifest_blocks = 0
+	header = REMOVAL_MANIFEST_MAGIC+" "+header.encode('utf-8')
+	removal_manifest_digest = hashlib.sha256(header).hexdigest()
+	try:
+		removal_manifest = open(filename, 'wb')
+		removal_manifest.write(header+"\n")
+	except Exception as e:
+		removal_manifest = None
+		msg = "Unable to write removal manifest "+filename+": "+str(e)
+		print(msg)
+		debug(msg, 'removal manifest open error writing log')
+
+
+def removal_manifest_item(item_id, name=None):
+	if removal_manifest is None:
+		return
+	record = {'id': item_id}
+	if name is not None:
+		record['name'] = name
+	removal_manifest_block.append(json.dumps(record, sort_keys=True)+"\n")
+	if len(removal_manifest_block) >= removalManifestBlockItems:
+		removal_manifest_seal()
+
+
+def removal_manifest_seal():
+	global removal_manifest_digest
+	global removal_manifest_block
+	global removal_manifest_blocks
+	block = ''.join(removal_manifest_block)
+	removal_manifest_digest = hashlib.sha256(removal_manifest_digest+block).hexdigest()
+	removal_manifest.write(block+"#"+removal_manifest_digest+"\n")
+	removal_manifest_block = []
+	removal_manifest_blocks += 1
+
+
+# Returns the root hash
+def removal_manifest_close():
+	global removal_manifest
+	if removal_manifest is None:
+		return None
+	# a manifest without removed items still gets a root hash
+	if len(removal_manifest_block) > 0 or removal_manifest_blocks == 0:
+		removal_manifest_seal()
+	removal_manifest.close()
+	removal_manifest = None
+	return removal_manifest_digest
+
+
+# Mutation phase: removes the items in verdicts from PA
+# Items that are already cleared or removed are skipped, so applying the
+# same verdicts again (e.g. a resumed run) does not change anything.
+# Bulk updates
+# Every Remove() and Tags.Clear() may raise a change notification that PA
+# handles one at a time. Between bulk_update_begin() and bulk_update_end()
+# (apply_verdicts() and undo_last_filter()) each collection is put into
+# bulk mode before its first change, if its type has one of the
+# BULK_UPDATE_METHODS pairs, and leaves it once after the last change, so
+# it is refreshed once. The datastore itself is tried first. Collections
+# without such methods are changed one notification at a time as before.
+BULK_UPDATE_METHODS = [('BeginUpdate', 'EndUpdate'), ('SuspendNotifications', 'ResumeNotifications')]
+
+# collection type: (begin, end) method names, or None if it has none
+bulk_update_types = {}
+# id of each collection changed in this bulk update: collection. None outside of one.
+bulk_collections = None
+# (collection, end method name) in the order they entered bulk mode
+bulk_order = []
+
+def bulk_update_begin():
+	global bulk_collections
+	global bulk_order
+	bulk_collections = {}
+	bulk_order = []
+	bulk_update(ds)
+
+
+# Puts collection into bulk mode before its first change
+def bulk_update(collection):
+	if bulk_collections is None or id(collection) in bulk_collections:
+		return
+	# keeps the collection referenced so its id is not reused
+	bulk_collections[id(collection)] = collection
+	t = type(collection)
+	if t not in bulk_update_types:
+		methods = None
+		for begin, end in BULK_UPDATE_METHODS:
+			if hasattr(collection, begin) and hasattr(collection, end):
+				methods = (begin, end)
+				break
+		bulk_update_types[t] = methods
+	methods = bulk_update_types[t]
+	if methods is None:
+		return
+	try:
+		getattr(collection, methods[0])()
+		bulk_order.append((collection, methods[1]))
+	except Exception as e:
+		print("Bulk update "+methods[0]+" error: "+str(e))
+
+
+def bulk_update_end():
+	global bulk_collections
+	global bulk_order
+	for collection, end in reversed(bulk_order):
+		try:
+			getattr(collection, end)()
+		except Exception as e:
+			print("Bulk update "+end+" error: "+str(e))
+	if len(bulk_order) > 0:
+		print("Bulk updated "+str(len(bulk_order))+" of "+str(len(bulk_collections))+" changed collections")
+	bulk_collections = None
+	bulk_order = []
+
+
+# Undo journal
+# apply_verdicts() records every change it makes to the datastore:
+#   ('tags', file, its tags before Tags.Clear())
+#   ('remove', collection, position, item) for each Remove()
+# undo_last_filter() replays the journal of the last run in reverse, so
+# restoring takes time in the number of removed items, not in the size of
+# the extraction, and the extraction does not have to be reopened.
+# The journal refers to the items of the open extraction and only lives
+# as long as the script's form.
+undo_journal = []
+
+# Removes item from collection and records where it was. 'position' is
+# where apply_verdicts() expects the item; it is only looked up with
+# IndexOf(), which searches the collection, if the item is not there.
+def journal_remove(collection, item, position=-1):
+	known = False
+	try:
+		known = position >= 0 and collection[position] is item
+	except Exception:
+		pass
+	if not known:
+		try:
+			position = collection.IndexOf(item)
+		except Exception:
+			position = -1
+	bulk_update(collection)
+	collection.Remove(item)
+	undo_journal.append(('remove', collection, position, item))
+
+
+# Restores the items removed by the last run. Returns the number of restored changes.
+def undo_last_filter():
+	global undo_journal
+	global timeline
+	timeline = None
+	restored = failed = 0
+	bulk_update_begin()
+	try:
+		for entry in reversed(undo_journal):
+			try:
+				if entry[0] == 'tags':
+					kind, f, tags = entry
+					bulk_update(f.Tags)
+					for tag in tags:
+						f.Tags.Add(tag)
+				else:
+					kind, collection, position, item = entry
+					bulk_update(collection)
+					if position >= 0:
+						collection.Insert(position, item)
+					else:
+						collection.Add(item)
+				restored += 1
+			except Exception as e:
+				failed += 1
+				print("Undo error: "+str(e))
+	finally:
+		bulk_update_end()
+	undo_journal = []
+	msg = "Undo last filter: restored "+str(restored)+" changes"
+	if failed > 0:
+		msg += ", "+str(failed)+" failed"
+	print(msg)
+	return restored
+
+
+def apply_verdicts():
+	global undo_journal
+	global timeline
+	undo_journal = []
+	# the timeline counts the items before they are removed
+	timeline = None
+	# Remove data files from PA list
+	t = 0
+	for cn, index, item_id, f in verdicts['DataFiles']:
+		removal_manifest_item(item_id, f.Name)
+		if len(f.Tags) > 0:
+			undo_journal.append(('tags', f, list(f.Tags)))
+			bulk_update(f.Tags)
+			f.Tags.Clear()
+			t+=1
+
+	# Verdicts are in item order, so an item's position is its index less
+	# the items already removed from the same collection.
+	# id(collection): items removed from it
+	removed = {}
+	def position(collection, index):
+		n = removed.get(id(collection), 0)
+		removed[id(collection)] = n+1
+		return index-n
+
+	# Remove items from PA GUI
+	n = c = 0 
+	for cn, index, item_id, f in verdicts['Models']:
+		removal_manifest_item(item_id)
+		if f.ModelCollection is not None:
+			journal_remove(f.ModelCollection, f, position(f.ModelCollection, index))
+			n+=1
+	for cn, index, im_index, item_id, f in verdicts['Messages']:
+		removal_manifest_item(item_id)
+		if f.ModelCollection is not None:
+			journal_remove(f.ModelCollection, f, position(f.ModelCollection, im_index))
+			c+=1
+	print "cleared chats = "+str(c)
+	print "cleared files = "+str(n)
 
-	msg = 'DeviceInfo: Processed '+str(ts_count-1)+' items'
-	print(msg)
-	debug(msg, 'DeviceInfo finish. error writing log')
-	
 	# Remove data entries from DeviceInfo list
-	nRemoved = len(listtoClear)
-	for i in listtoClear:
+	d = 0
+	for index, item_id, i in verdicts['DeviceInfo']:
+		removal_manifest_item(item_id, i.Value)
 		# This seems to remove it from DeviceInfo, but doesn't update GUI.
 		# But the report seems to work correctly. 
-		ds.DeviceInfo.Remove(i)
+		if i in ds.DeviceInfo:
+			journal_remove(ds.DeviceInfo, i, position(ds.DeviceInfo, index))
+			d+=1
+
+	skipped = len(verdicts['DataFiles'])-t + len(verdicts['Models'])-n + len(verdicts['Messages'])-c + len(verdicts['DeviceInfo'])-d
+	if skipped > 0:
+		msg = "Already removed, skipped: "+str(skipped)
+		print(msg)
+		debug(msg, 'apply verdicts error writing log')
+
+
+# Verdict cache
+# The verdicts of a run are saved by item position under verdictCacheDir,
+# keyed by a fingerprint of the datastore (device, PA version, item counts
+# per category), the date range, the options and the timestamp policy.
+# Re-running the same range on the same freshly opened extraction (e.g.
+# after PA crashed during removal) skips straight to the mutation phase.
+# Once items are removed the counts change, so a cache is never applied twice.
+useVerdictCache = True
+verdictCacheDir = "./Logs/verdict_cache"
+verdictCacheMaxBytes = 64*1024*1024
+VERDICT_CACHE_VERSION = 4
+
+# len() of a PA collection, listing it if needed
+def count_items(items):
+	try:
+		return len(items)
+	except TypeError:
+		return len(list(items))
+
+
+# Verdicts as JSON item positions and identities
+def model_types_by_name():
+	models = {}
+	for m in ds.Models:
+		models[model_type_info(m.ModelType)[0]] = m.ModelType
+	return models
+
+
+def dump_verdicts():
+	models = model_types_by_name()
+	return {
+		'DataFiles': [[cn, index, item_id, item_digest('DataFiles', f)] for cn, index, item_id, f in verdicts['DataFiles']],
+		'Models': [[cn, index, item_id, item_digest('Models', f, models[cn])] for cn, index, item_id, f in verdicts['Models']],
+		'Messages': [[cn, index, im_index, item_id, item_digest('Messages', im)] for cn, index, im_index, item_id, im in verdicts['Messages']],
+		'DeviceInfo': [[index, item_id, item_digest('DeviceInfo', i)] for index, item_id, i in verdicts['DeviceInfo']],
+		}
+
+
+# Verdicts of dump_verdicts() resolved to the items of 'ds'. Raises
+# ValueError if a position does not hold the item that was classified.
+def resolve_verdicts(positions):
+	files = {}
+	if pa_files is not None:
+		for key, category_files in iter_DataFiles():
+			files[datafile_category_info(key)[0]] = category_files
+	models = model_types_by_name()
+
+	resolved = new_verdicts()
+	def check(stage, name, index, digest, item, model_type=None):
+		if item_digest(stage, item, model_type) != digest:
+			raise ValueError("item "+str(index)+" of "+name+" is not the item that was classified")
+		return item
+	item_lists = {}
+	def items_of(cn):
+		if cn not in item_lists:
+			if cn in files:
+				item_lists[cn] = list(files[cn])
+			else:
+				item_lists[cn] = list(ds.Models[models[cn]])
+		return item_lists[cn]
+	for cn, index, item_id, digest in positions['DataFiles']:
+		f = check('DataFiles', cn, index, digest, items_of(cn)[index])
+		resolved['DataFiles'].append((cn, index, item_id, f))
+	for cn, index, item_id, digest in positions['Models']:
+		f = check('Models', cn, index, digest, items_of(cn)[index], models[cn])
+		resolved['Models'].append((cn, index, item_id, f))
+	for cn, index, im_index, item_id, digest in positions['Messages']:
+		im = check('Messages', cn, str(index)+"/"+str(im_index), digest, list(items_of(cn)[index].Messages)[im_index])
+		resolved['Messages'].append((cn, index, im_index, item_id, im))
+	entries = list(ds.DeviceInfo)
+	for index, item_id, digest in positions['DeviceInfo']:
+		i = check('DeviceInfo', 'DeviceInfo', index, digest, entries[index])
+		resolved['DeviceInfo'].append((index, item_id, i))
+	# the last item done before a checkpoint, items before it are not classified again
+	if 'last' in positions:
+		stage, cn, index = positions['stage'], positions['category'], positions['index']-1
+		if stage == 'DeviceInfo':
+			check('DeviceInfo', 'DeviceInfo', index, positions['last'], entries[index])
+		elif stage == 'DataFiles':
+			check('DataFiles', cn, index, positions['last'], items_of(cn)[index])
+		else:
+			check('Models', cn, index, positions['last'], items_of(cn)[index], models[cn])
+	return resolved
+
+
+# Hash of the datastore's item counts, DeviceInfo and the options that decide
+# verdicts. Without include_range it identifies the datastore for the
+# previous snapshot's category spans: the date range and the options that
+# only decide what is done with the recorded timestamps are left out, so a
+# run with the sanity check, chat envelope or attachment option changed
+# still finds the spans and quartiles of the run before it.
+def datastore_fingerprint(include_range=True):
+	parts = [
+		'version='+str(VERDICT_CACHE_VERSION),
+		'device='+device_name(),
+		'pa='+pa_version,
+		]
+	if include_range:
+		parts += [
+			'range='+str(start_ticks)+'-'+str(end_ticks),
+			'sanityCheckTimestamps='+str(sanityCheckTimestamps),
+			'useChatEnvelope='+str(useChatEnvelope),
+			'keepAttachmentsWithItems='+str(keepAttachmentsWithItems),
+			]
+	parts += [
+		'doNotDateFilterDeleted='+str(doNotDateFilterDeleted),
+		'doNotFilterContact_by_LastContacted='+str(doNotFilterContact_by_LastContacted),
+		'deviceTimeZone='+str(deviceTimeZone),
+		'exifFallback='+str(exifFallback),
+		'containerTimestamps='+str(containerTimestamps),
+		'policy='+json.dumps(load_timestamp_policy(), sort_keys=True),
+		]
+	if pa_files is not None:
+		for key, files in iter_DataFiles():
+			parts.append(datafile_category_info(key)[0]+'='+str(count_items(files)))
+	for m in ds.Models:
+		parts.append(model_type_info(m.ModelType)[0]+'='+str(count_items(ds.Models[m.ModelType])))
+	parts.append('DeviceInfo='+str(count_items(ds.DeviceInfo)))
+	# identifiers of the handset (IMEI, serial number, ...), so two phones of the same model differ
+	for i in ds.DeviceInfo:
+		parts.append('DeviceInfo:'+unicode(i.Name)+'='+unicode(i.Value))
+	return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def verdict_cache_file(fingerprint):
+	return verdictCacheDir+"/"+fingerprint+".json"
+
+
+# audit_position() saved with the cached verdicts or checkpoint in use
+previous_audit = None
+
+# Verdicts saved under fingerprint, resolved to the items of 'ds'. None if not cached.
+def load_cached_verdicts(fingerprint):
+	global previous_audit
+	previous_audit = None
+	if useVerdictCache is not True:
+		return None
+	try:
+		cache_file = open(verdict_cache_file(fingerprint))
+	except IOError:
+		return None
+	try:
+		try:
+			cached = json.load(cache_file)
+		finally:
+			cache_file.close()
+		if cached.get('version') != VERDICT_CACHE_VERSION or cached.get('fingerprint') != fingerprint:
+			return None
+		# any item that moved invalidates the whole cache
+		resolved = resolve_verdicts(cached)
+		previous_audit = cached.get('audit')
+		return resolved
+	except Exception as e:
+		msg = "Ignoring verdict cache "+verdict_cache_file(fingerprint)+": "+str(e)
+		print(msg)
+		debug(msg, 'verdict cache error writing log')
+		return None
+
+
+def save_cached_verdicts(fingerprint):
+	if useVerdictCache is not True:
+		return
+	try:
+		if not os.path.isdir(verdictCacheDir):
+			os.makedirs(verdictCacheDir)
+		cached = dump_verdicts()
+		cached['version'] = VERDICT_CACHE_VERSION
+		cached['fingerprint'] = fingerprint
+		cached['audit'] = audit_position()
+		cache_file = open(verdict_cache_file(fingerprint), 'w')
+		try:
+			json.dump(cached, cache_file)
+		finally:
+			cache_file.close()
+		evict_verdict_cache()
+	except Exception as e:
+		msg = "Unable to save verdict cache: "+str(e)
+		print(msg)
+		debug(msg, 'verdict cache error writing log')
+
+
+# Removes the oldest cache files until the cache is below verdictCacheMaxBytes
+def evict_verdict_cache():
+	entries = []
+	total = 0
+	for name in os.listdir(verdictCacheDir):
+		path = verdictCacheDir+"/"+name
+		size = os.path.getsize(path)
+		entries.append((os.path.getmtime(path), size, path))
+		total += size
+	entries.sort()
+	for mtime, size, path in entries:
+		if total <= verdictCacheMaxBytes:
+			break
+		os.remove(path)
+		total -= size
+
+
+# Checkpoints
+# While classifying, the stage, category, number of items done in it, the
+# verdicts and the attachment index so far are written to the checkpoint file of the datastore
+# fingerprint every checkpointSeconds. A run that finds a checkpoint of the
+# same fingerprint (PA died during a run and the case was opened again)
+# continues after the checkpoint instead of starting over. Categories are
+# visited in the same order on every run, so everything before the
+# checkpoint category is done. The checkpoint is deleted when a run finishes.
+resumeFromCheckpoint = True
+checkpointSeconds = 60
+CHECKPOINT_STAGES = ['AnalyzedData', 'DataFiles', 'DeviceInfo']
+
+checkpoint_filename = None
+checkpoint_fingerprint = None
+checkpoint_time = 0
+# (stage, category, items done) of the checkpoint being resumed
+resume_at = None
+
+def checkpoint_file(fingerprint):
+	return "./Logs/PA_date_filter-"+fingerprint+".checkpoint.json"
+
+
+def checkpoint_begin(fingerprint):
+	global checkpoint_filename
+	global checkpoint_fingerprint
+	global checkpoint_time
+	global resume_at
+	global verdicts
+	global attachment_index
+	global identity_ordinals
+	global previous_audit
+	checkpoint_filename = checkpoint_file(fingerprint)
+	previous_audit = None
+	checkpoint_fingerprint = fingerprint
+	checkpoint_time = time.time()
+	resume_at = None
+	if resumeFromCheckpoint is not True or not os.path.exists(checkpoint_filename):
+		return False
+	try:
+		cp_file = open(checkpoint_filename)
+		try:
+			cp = json.load(cp_file)
+		finally:
+			cp_file.close()
+		if cp.get('version') != VERDICT_CACHE_VERSION or cp.get('fingerprint') != fingerprint:
+			return False
+		verdicts = resolve_verdicts(cp)
+		attachment_index = cp.get('attachments', {})
+		identity_ordinals = cp.get('ordinals', {})
+		previous_audit = cp.get('audit')
+		resume_at = (cp['stage'], cp['category'], cp['index'])
+	except Exception as e:
+		# a checkpoint of items that moved is of no use to any later run
+		verdicts = new_verdicts()
+		attachment_index = {}
+		identity_ordinals = {}
+		previous_audit = None
+		resume_at = None
+		try:
+			os.remove(checkpoint_filename)
+		except OSError:
+			pass
+		msg = "Ignoring checkpoint "+checkpoint_filename+": "+str(e)
+		print(msg)
+		debug(msg, 'checkpoint error writing log')
+		return False
+	msg = "\nResuming from checkpoint "+checkpoint_filename+": "+cp['stage']+" "+cp['category']+" after item "+str(cp['index'])
+	print(msg)
+	debug(msg, 'checkpoint error writing log')
+	return True
+
+
+# Number of items of 'category' to skip, None if the whole category was done before the checkpoint
+def resume_from(stage, category):
+	global resume_at
+	if resume_at is None:
+		return 0
+	r_stage, r_category, r_index = resume_at
+	if CHECKPOINT_STAGES.index(stage) < CHECKPOINT_STAGES.index(r_stage):
+		return None
+	if stage == r_stage and category != r_category:
+		return None
+	resume_at = None
+	if stage == r_stage:
+		return r_index
+	return 0
+
+
+# Called after each item. 'index' items of 'category' are done, the last
+# one is 'item' (of 'model_type' for Analyzed Data).
+def checkpoint(stage, category, index, item, model_type=None):
+	global checkpoint_time
+	if checkpoint_filename is None or time.time() - checkpoint_time < checkpointSeconds:
+		return
+	cp = dump_verdicts()
+	cp['version'] = VERDICT_CACHE_VERSION
+	cp['fingerprint'] = checkpoint_fingerprint
+	cp['stage'] = stage
+	cp['category'] = category
+	cp['index'] = index
+	cp['last'] = item_digest({'AnalyzedData': 'Models'}.get(stage, stage), item, model_type)
+	cp['attachments'] = attachment_index
+	cp['ordinals'] = identity_ordinals
+	cp['audit'] = audit_position()
+	try:
+		# replace the previous checkpoint only once the new one is complete
+		cp_file = open(checkpoint_filename+'.tmp', 'w')
+		try:
+			json.dump(cp, cp_file)
+		finally:
+			cp_file.close()
+		if os.path.exists(checkpoint_filename):
+			os.remove(checkpoint_filename)
+		os.rename(checkpoint_filename+'.tmp', checkpoint_filename)
+	except Exception as e:
+		debug("Error writing checkpoint: "+str(e), 'checkpoint error writing log')
+	checkpoint_time = time.time()
+
+
+# Stops checkpointing. The checkpoint is deleted if the run finished; a run
+# that raised keeps it to resume from, but nothing writes to it any more.
+def checkpoint_end(finished=True):
+	global checkpoint_filename
+	global resume_at
+	if finished and checkpoint_filename is not None and os.path.exists(checkpoint_filename):
+		try:
+			os.remove(checkpoint_filename)
+		except OSError:
+			pass
+	checkpoint_filename = None
+	resume_at = None
+
+
+# Display Name of the open device, '' if there is none
+def device_name():
+	displayName = ds.DeviceInfo['Display Name']
+	if displayName is None:
+		return ''
+	try:
+		return str(displayName)
+	except Exception as e:
+		return ''
+
+
+# Filters the datastore 'ds' for the dates fromDate - toDate.
+# Writes the log and returns the removed counts. Raises IOError if the
+# log cannot be written.
+def run_filter(fromDate, toDate):
+	global dt_start
+	global dt_end
+	global log
+	global start_ticks
+	global end_ticks
+	global snapshot_device
+	global snapshot_fingerprint
+	global verdicts
+	global envelope_chats
+	global envelope_messages
+
+	dt_start = TimeStamp(System.Convert.ToDateTime(fromDate), True)
+	dt_end = TimeStamp(System.Convert.ToDateTime(toDate), True)
+	proc_start = datetime.now()
+
+	# We want to use device's Display Name as the log filename.
+	# Fix errors with Unicode characters in displayName for the log filename.
+	snapshot_device = device_name()
+	filename = 'default_log_filename.txt'+"-"+str(proc_start)[:-7]+".txt"
+	if snapshot_device != '':
+		ustr = snapshot_device.encode('utf-8', 'ignore')
+		#remove last 7 characters from string, add .txt
+		filename = "PA_date_filter_log-"+str(ustr)+"-"+str(proc_start)[:-7]+".txt"
+
+	filename = filename.replace(":","")
+	filename = filename.replace(" ","_")
+	# batch runs can start within the same second
+	n = 2
+	base = filename
+	while os.path.exists("./Logs/"+filename):
+		filename = base[:-4]+"-"+str(n)+".txt"
+		n += 1
+	# writes to default Cellebrite PA installation folder
+	log = SegmentedLog("./Logs/"+filename)
+	# a run that raises still closes its log and audit
+	completed = False
+	try:
+		msg = "PA_date_filter.py script started: "+str(proc_start)+"\n"
+		msg_dates = "Daterange from: "+str(fromDate)+" - "+str(toDate)+"\n"
+		if doNotDateFilterDeleted is True:
+			msg += "Not applying date filter to deleted data\n"
+		else:
+			msg += "Applying date filter to deleted data\n"
+		if doNotFilterContact_by_LastContacted is True:
+			msg += "Not applying date filter to Contact's LastContacted timestamp\n"
+		else:
+			msg += "Applying date filter to Contact's LastContacted timestamp\n"
+		if deviceTimeZone is not None:
+			msg += "Device time zone: "+deviceTimeZone+"\n"
+		if sanityCheckTimestamps is True:
+			msg += "Treating implausible timestamps as None\n"
 		
-	print "\n***********************************"
-	msg = "DeviceInfo items removed = "+str(nRemoved)
-	print (msg)
-	debug(msg, 'Error writing log DeviceInfo items removed')
-	return nRemoved
+		print(msg)
+		print(msg_dates)
+		log.write(msg)
+		log.write(msg_dates)
+
+		# date range as UTC ticks for the checks that do not use TimeStamp
+		start_ticks = System.Convert.ToDateTime(fromDate).ToUniversalTime().Ticks
+		end_ticks = System.Convert.ToDateTime(toDate).ToUniversalTime().Ticks
+		build_type_cache()
+		if probe_datastore():
+			msg = pa_version+" processing"
+		else:
+			msg = "Unknown PA version"
+		print(msg)
+		log.write(msg)
+
+		audit_filename = "./Logs/"+filename[:-4]+".audit.jsonl"
+		audit_open(audit_filename)
+		verdicts = None
+		fingerprint = datastore_fingerprint()
+		verdicts = load_cached_verdicts(fingerprint)
+		if verdicts is not None:
+			msg = "\nUsing cached verdicts "+verdict_cache_file(fingerprint)
+			print(msg)
+			debug(msg, 'verdict cache error writing log')
+			if not audit_carry(previous_audit):
+				audit_verdicts('cached')
+				audit_mark_partial("verdicts from the verdict cache, the audit of the run that classified them was not found: only removed items have records (rule 'cached')")
+			sanity_begin({})
+			envelope_chats = envelope_messages = 0
+		else:
+			verdicts = new_verdicts()
+			snapshot_fingerprint = datastore_fingerprint(False)
+			load_previous_spans()
+			sanity_begin(previous_quartiles)
+			attachments_begin()
+			identity_begin()
+			snapshot_filename = "./Logs/"+filename+".snapshot"
+			# the snapshot of a resumed run would miss the items before the checkpoint
+			if checkpoint_begin(fingerprint):
+				if not audit_carry(previous_audit):
+					audit_mark_partial("resumed from a checkpoint, the audit of the interrupted run was not found: items before "+" ".join([str(x) for x in resume_at])+" have no records")
+			elif writeTimestampSnapshot is True:
+				snapshot_open(snapshot_filename)
+			finished = False
+			try:
+				# Analyzed Data first, Data Files look up the attachment index
+				filter_AnalyzedData2()
+				if pa_files is not None:
+					filter_DataFiles()
+				filter_DeviceInfo()
+				sanity_report()
+				snapshot_close(snapshot_filename)
+				save_cached_verdicts(fingerprint)
+				finished = True
+			finally:
+				checkpoint_end(finished)
 
+		removal_manifest_filename = "./Logs/"+filename[:-4]+".removed.txt"
+		removal_manifest_open(removal_manifest_filename, snapshot_device+" "+str(fromDate)+" - "+str(toDate))
+		bulk_update_begin()
+		try:
+			apply_verdicts()
+		finally:
+			bulk_update_end()
+		root_hash = removal_manifest_close()
+		audit_close(audit_filename)
+		num_df_removed = len(verdicts['DataFiles'])
+		num_ad_removed = len(verdicts['Models'])+len(verdicts['Messages'])
+		num_di_removed = len(verdicts['DeviceInfo'])
+		total_removed = num_df_removed+num_ad_removed+num_di_removed
+
+		proc_end = datetime.now()
+		duration = (proc_end - proc_start)
 	
+		try:
+			log.write("\nRemoved: "+str(num_df_removed)+" Data Files." )
+			log.write("\nRemoved: "+str(num_ad_removed)+" Analyzed Data items.")
+			log.write("\nRemoved: "+str(num_di_removed)+" DeviceInfo items.")
+			log.write("\nRemoved: "+str(total_removed)+" Total items.")
+			if root_hash is not None:
+				log.write("\nRemoval manifest "+removal_manifest_filename+" root hash: "+root_hash)
+			t = proc_end
+			endtime = str(t.year)+"-"+str(t.month)+" "+str(t.day)+" "+str(t.hour)+":"+str(t.minute)+":"+str(t.second)
+			log.write("\nScript ended "+str(endtime)+"\n")
+			log.write("Daterange from: "+str(proc_start)+" - "+str(proc_end)+"\n")
+			log.write("Duration: "+str(duration)+"\n")
+		except Exception as e:
+			errmsg = "Error at Processing ended. "+str(e)
+			print(errmsg)
+			debug(errmsg, "error closing log")
+		log.close()
+		completed = True
+	finally:
+		if not completed:
+			run_filter_failed()
+
+	return {
+		'display_name': snapshot_device,
+		'from': fromDate,
+		'to': toDate,
+		'pa_version': pa_version,
+		'log': "./Logs/"+filename,
+		'log_index': log.index_filename,
+		'audit': audit_filename,
+		'removal_manifest': removal_manifest_filename,
+		'root_hash': root_hash,
+		'implausible': dict(sanity_flagged),
+		'chat_envelope': {'chats': envelope_chats, 'messages': envelope_messages},
+		'removed': {
+			'DataFiles': num_df_removed,
+			'AnalyzedData': num_ad_removed,
+			'DeviceInfo': num_di_removed,
+			'Total': total_removed,
+			},
+		'duration': str(duration),
+		}
+
+
+# Closes the files of a run_filter() that raised. The audit is marked
+# partial; the removal manifest lists the items removed before it failed.
+def run_filter_failed():
+	global snapshot
+	try:
+		log.write("\nScript failed "+str(datetime.now())+"\n")
+	except Exception as e:
+		print("Error writing log: "+str(e))
+	if snapshot is not None:
+		try:
+			snapshot.close()
+		except Exception:
+			pass
+		snapshot = None
+	removal_manifest_close()
+	audit_mark_partial("the run failed before it finished")
+	audit_close(audit_filename)
+	log.close()
+
+
+# Evaluates every timestamp of 'ds' into the timeline without removing
+# anything. The date range is empty, so no timestamp is within it: chat
+# envelopes and collections of timestamps do not stop early. The classifier
+# output goes to a timeline log. Returns the number of timestamps.
+def build_timeline():
+	global dt_start
+	global dt_end
+	global log
+	global start_ticks
+	global end_ticks
+	global verdicts
+	global previous_spans
+	global timeline_category
+	global timeline_building
+
+	proc_start = datetime.now()
+	filename = "PA_date_filter_timeline-"+str(proc_start)[:-7]+".txt"
+	filename = filename.replace(":","")
+	filename = filename.replace(" ","_")
+	log = SegmentedLog("./Logs/"+filename)
+	msg = "PA_date_filter.py timeline started: "+str(proc_start)+"\nNothing is removed, the date range below is empty on purpose\n"
+	print(msg)
+	log.write(msg)
+
+	dt_start = TimeStamp(System.Convert.ToDateTime("2999-12-31 00:00:00"), True)
+	dt_end = TimeStamp(System.Convert.ToDateTime("1900-01-01 00:00:00"), True)
+	start_ticks = toTicks(dt_start)
+	end_ticks = toTicks(dt_end)
+	build_type_cache()
+	probe_datastore()
+	verdicts = new_verdicts()
+	previous_spans = {}
+	# empty range verdicts must never be checkpointed, nor resume a failed run
+	checkpoint_end(False)
+	sanity_begin({})
+	attachments_begin()
+	identity_begin()
+	timeline_begin()
+	try:
+		filter_AnalyzedData2()
+		if pa_files is not None:
+			filter_DataFiles()
+		filter_DeviceInfo()
+	finally:
+		timeline_building = False
+		timeline_category = None
+		verdicts = None
+		log.close()
+
+	total = 0
+	for n, all_ticks in timeline_count(0, 0).values():
+		total += all_ticks
+	msg = "Timeline: "+str(total)+" timestamps in "+str(len(timeline_categories))+" categories, "+str(datetime.now() - proc_start)
+	print(msg)
+	return total
+
+
+# Equivalence oracle
+# run_oracle() classifies the Analyzed Data of 'ds' with the legacy
+# filter_AnalyzedData() and with an engine (filter_AnalyzedData2() by
+# default, with all of its shortcuts) for the same range, without removing
+# anything. It then compares the two verdicts of every item. The engine's
+# verdicts and rules come from its audit. Mismatches are grouped by the
+# engine's rule and written to ./Logs/PA_date_filter_oracle-<time>.json with
+# up to ORACLE_SAMPLES item identities per group. 'ds' can be the open
+# extraction or a large stand-in datastore assigned from the Python shell.
+# Some differences are by design, e.g. Contacts (see
+# doNotFilterContact_by_LastContacted) and model types the legacy filter
+# does not know.
+ORACLE_SAMPLES = 20
+
+def run_oracle(fromDate, toDate, engine=None):
+	global dt_start
+	global dt_end
+	global log
+	global start_ticks
+	global end_ticks
+	global verdicts
+	global previous_spans
+	global legacy_removed
+	global writeAudit
+	if engine is None:
+		engine = filter_AnalyzedData2
+
+	dt_start = TimeStamp(System.Convert.ToDateTime(fromDate), True)
+	dt_end = TimeStamp(System.Convert.ToDateTime(toDate), True)
+	start_ticks = System.Convert.ToDateTime(fromDate).ToUniversalTime().Ticks
+	end_ticks = System.Convert.ToDateTime(toDate).ToUniversalTime().Ticks
+	proc_start = datetime.now()
+	filename = "PA_date_filter_oracle-"+str(proc_start)[:-7]+".txt"
+	filename = filename.replace(":","")
+	filename = filename.replace(" ","_")
+	log = SegmentedLog("./Logs/"+filename)
+	msg = "PA_date_filter.py equivalence oracle started: "+str(proc_start)+"\nDaterange from: "+str(fromDate)+" - "+str(toDate)+"\nNothing is removed\n"
+	print(msg)
+	log.write(msg)
+	build_type_cache()
+	probe_datastore()
+	previous_spans = {}
+	# verdicts of a comparison must never be checkpointed, nor resume a failed run
+	checkpoint_end(False)
+	sanity_begin({})
+	attachments_begin()
+
+	legacy_removed = []
+	try:
+		filter_AnalyzedData()
+		removed_ids = set([id(f) for f in legacy_removed])
+	finally:
+		legacy_removed = None
+
+	audit_filename = "./Logs/"+filename[:-4]+".audit.jsonl"
+	write_audit = writeAudit
+	writeAudit = True
+	verdicts = new_verdicts()
+	identity_begin()
+	try:
+		audit_open(audit_filename)
+		engine()
+	finally:
+		audit_close(audit_filename)
+		writeAudit = write_audit
+		verdicts = None
+	log.close()
+
+	# positions of the items the legacy filter removed, as in the audit
+	legacy = set()
+	for m in ds.Models:
+		cn, mtype, cn_messages = model_type_info(m.ModelType)
+		index = 0
+		for f in ds.Models[m.ModelType]:
+			if id(f) in removed_ids:
+				legacy.add((cn, str(index)))
+			if index == 0:
+				chats = f.FieldExists('Messages')
+			if chats:
+				im_index = 0
+				for im in f.Messages:
+					if id(im) in removed_ids:
+						legacy.add((cn_messages, str(index)+"/"+str(im_index)))
+					im_index += 1
+			index += 1
+
+	groups = {}
+	compared = 0
+	audit_file = open(audit_filename)
+	try:
+		for line in audit_file:
+			record = json.loads(line)
+			compared += 1
+			key = (record['category'], str(record['index']))
+			legacy_verdict = 'kept'
+			if key in legacy:
+				legacy_verdict = 'removed'
+				legacy.remove(key)
+			if legacy_verdict != record['verdict']:
+				group = groups.setdefault((record['rule'], legacy_verdict, record['verdict']), [0, []])
+				group[0] += 1
+				if len(group[1]) < ORACLE_SAMPLES:
+					group[1].append({'id': record['id'], 'category': key[0], 'index': key[1]})
+	finally:
+		audit_file.close()
+	# removed by the legacy filter but not classified by the engine
+	for category, index in legacy:
+		group = groups.setdefault(('not classified', 'removed', 'kept'), [0, []])
+		group[0] += 1
+		if len(group[1]) < ORACLE_SAMPLES:
+			group[1].append({'id': None, 'category': category, 'index': index})
+
+	mismatches = []
+	for rule, legacy_verdict, engine_verdict in sorted(groups):
+		count, samples = groups[(rule, legacy_verdict, engine_verdict)]
+		mismatches.append({'rule': rule, 'legacy': legacy_verdict, 'engine': engine_verdict, 'count': count, 'samples': samples})
+	report = {
+		'from': fromDate,
+		'to': toDate,
+		'engine': engine.__name__,
+		'compared': compared,
+		'mismatches': mismatches,
+		'log': "./Logs/"+filename,
+		'audit': audit_filename,
+		}
+	report_filename = "./Logs/"+filename[:-4]+".json"
+	report_file = open(report_filename, 'w')
+	try:
+		json.dump(report, report_file, indent=1)
+	finally:
+		report_file.close()
+	report['report'] = report_filename
+
+	msg = "Oracle: "+str(compared)+" items compared, "+str(sum([m['count'] for m in mismatches]))+" mismatches"
+	for m in mismatches:
+		msg += "\n\t"+m['rule']+": legacy "+m['legacy']+", "+report['engine']+" "+m['engine']+": "+str(m['count'])
+	msg += "\nReport: "+report_filename
+	print(msg)
+	return report
+
+
+# Batch mode
+# A manifest (JSON) lists the cases to filter, each with its own date range:
+# {
+#  "report": "./Logs/PA_date_filter_batch_report.json",
+#  "cases": [
+#   {"name": "Case 1", "device": "<device Display Name>",
+#    "from": "2018-08-20 00:00:00-7", "to": "2019-02-20 23:59:59-8",
+#    "doNotDateFilterDeleted": true, "doNotFilterContact_by_LastContacted": true,
+#    "deviceTimeZone": "Pacific Standard Time"}
+#  ]
+# }
+# A PA script only sees the extraction that is open in PA, so by default a
+# case runs against 'ds' when its "device" is empty or matches the open
+# device, and is reported as skipped otherwise. run_manifest() takes another
+# openCase function to supply the datastore of each case (e.g. a stand-in
+# datastore from the Python shell).
+# Cases of the same device run back to back so the policy, EXIF format and
+# datastore probe caches are reused. There is no I/O to overlap with in a
+# single PA script thread.
+# Filtering removes items from the datastore, so a second case against a
+# datastore that was already filtered (by an earlier case, or by a filter
+# run before the batch that was not undone) would be filtered on top of the
+# first one's removals. Such a case is reported as skipped; reopen the
+# extraction and run it again.
+BATCH_REPORT = "./Logs/PA_date_filter_batch_report.json"
+
+def open_case(case):
+	device = case.get('device', '')
+	if device == '' or device == device_name():
+		return ds
+	return None
+
+
+def run_manifest(manifest_filename, openCase=open_case):
+	global ds
+	global pa_files
+	global doNotDateFilterDeleted
+	global doNotFilterContact_by_LastContacted
+	global deviceTimeZone
+
+	manifest_file = open(manifest_filename)
+	try:
+		manifest = json.load(manifest_file)
+	finally:
+		manifest_file.close()
+
+	cases = list(manifest['cases'])
+	# stable sort keeps the manifest order within a device
+	cases.sort(key=lambda case: isinstance(case, dict) and case.get('device', '') or '')
+
+	options = (doNotDateFilterDeleted, doNotFilterContact_by_LastContacted, deviceTimeZone)
+	# [(datastore, what filtered it)]
+	filtered = []
+	if len(undo_journal) > 0:
+		filtered.append((ds, 'a filter run before the batch'))
+	report = {
+		'manifest': manifest_filename,
+		'report': manifest.get('report', BATCH_REPORT),
+		'started': str(datetime.now()),
+		'cases': [],
+		}
+	for case in cases:
+		entry = {'name': '', 'device': ''}
+		report['cases'].append(entry)
+		# a bad case is reported, the other cases still run
+		try:
+			if not isinstance(case, dict):
+				raise ValueError("case is not an object")
+			entry['name'] = case.get('name', '')
+			entry['device'] = case.get('device', '')
+			for key in ['from', 'to']:
+				if not isinstance(case.get(key), basestring):
+					raise ValueError("case has no '"+key+"' date")
+				entry[key] = case[key]
+			case_ds = openCase(case)
+			if case_ds is None:
+				entry['status'] = 'skipped: extraction is not open in PA'
+				continue
+			filtered_by = None
+			for filtered_ds, name in filtered:
+				if filtered_ds is case_ds:
+					filtered_by = name
+			if filtered_by is not None:
+				entry['status'] = 'skipped: datastore already filtered by '+filtered_by+', reopen the extraction to run this case'
+				print("Batch case "+entry['name']+": "+entry['status'])
+				continue
+			if case_ds is not ds:
+				ds = case_ds
+				# probe the new datastore's PA version
+				pa_files = None
+			doNotDateFilterDeleted = case.get('doNotDateFilterDeleted', options[0])
+			doNotFilterContact_by_LastContacted = case.get('doNotFilterContact_by_LastContacted', options[1])
+			deviceTimeZone = case.get('deviceTimeZone', options[2])
+			# even a failed run may have removed items
+			filtered.append((case_ds, 'case '+entry['name']))
+			entry.update(run_filter(case['from'], case['to']))
+			entry['status'] = 'done'
+		except Exception as e:
+			entry['status'] = 'error: '+str(e)
+		msg = "Batch case "+entry['name']+": "+entry['status']
+		print(msg)
+	doNotDateFilterDeleted, doNotFilterContact_by_LastContacted, deviceTimeZone = options
+	report['ended'] = str(datetime.now())
+
+	report_file = open(report['report'], 'w')
+	try:
+		json.dump(report, report_file, indent=1)
+	finally:
+		report_file.close()
+	return report
+
 
 class filterForm(Form):
 	def __init__(self):
@@ -1547,6 +4716,23 @@ class filterForm(Form):
 		self.button2.Location = Point(225, 225)
 		self.button2.Click += self.closeThis
 
+		self.button3 = Button()
+		self.button3.Text = 'Batch...'
+		self.button3.Location = Point(325, 225)
+		self.button3.Click += self.runBatch
+
+		self.button4 = Button()
+		self.button4.Text = 'Undo last filter'
+		self.button4.Location = Point(325, 255)
+		self.button4.Width = 100
+		self.button4.Enabled = False
+		self.button4.Click += self.undoFilter
+
+		self.button5 = Button()
+		self.button5.Text = 'Preview'
+		self.button5.Location = Point(25, 255)
+		self.button5.Click += self.previewRange
+
 		self.statusLabel = Label()
 		self.statusLabel.Text = ""
 		self.statusLabel.Location = Point(105, 265)
@@ -1567,6 +4753,9 @@ class filterForm(Form):
 		self.Controls.Add(self.button0)
 		self.Controls.Add(self.button1)
 		self.Controls.Add(self.button2)
+		self.Controls.Add(self.button3)
+		self.Controls.Add(self.button4)
+		self.Controls.Add(self.button5)
 		self.Controls.Add(self.statusLabel)
 		
 		self.CenterToParent()
@@ -1614,7 +4803,6 @@ class filterForm(Form):
 	def filterByDates(self, sender, event):
 		global dt_start
 		global dt_end
-		global log
 
 		fromDate = self.fromTextBox.Text
 		toDate = self.toTextBox.Text
@@ -1630,115 +4818,101 @@ class filterForm(Form):
 			MessageBox.Show("End time must be greater than start time.")
 			return False
 			
-		self.check.Enabled = False
-		self.check2.Enabled = False
-		self.button0.Enabled = False
-		self.button1.Enabled = False
-		self.button2.Enabled = False
+		self.enableControls(False)
 		
 		self.statusLabel.Text = 'Processing data... please wait.'
 		MessageBox.Show('Finding all data between\n\nStart: '+str(dt_start)+'\nEnd: '+str(dt_end)+'\n\nclick OK to start')
-		proc_start = datetime.now()
-	
-		# We want to use device's Display Name as the log filename.
-		# Fix errors with Unicode characters in displayName for the log filename.
-		displayName = ds.DeviceInfo['Display Name']
-		filename = 'default_log_filename.txt'+"-"+str(proc_start)[:-7]+".txt"
-		if displayName is not None:
-			try:
-				if displayName.isunicode:
-					ustr = displayName.encode('utf-8', 'ignore')
-					msg += ustr
-					#remove last 7 characters from string, add .txt
-					filename = "PA_date_filter_log-"+str(ustr)+"-"+str(proc_start)[:-7]+".txt"
-				else:
-					msg += str(displayName)
-					filename = str(displayName)
-			except UnicodeEncodeError as e:
-				msg += "UnicodeEncodeError: bad displayName"
 
-		filename = filename.replace(":","")
-		filename = filename.replace(" ","_")
 		try:
-			# writes to default Cellebrite PA installation folder
-			log = open("./Logs/"+filename, 'w')
-			msg = "PA_date_filter.py script started: "+str(proc_start)+"\n"
-			msg_dates = "Daterange from: "+str(fromDate)+" - "+str(toDate)+"\n"
-			if doNotDateFilterDeleted is True:
-				msg += "Not applying date filter to deleted data\n"
-			else:
-				msg += "Applying date filter to deleted data\n"
-			if doNotFilterContact_by_LastContacted is True:
-				msg += "Not applying date filter to Contact's LastContacted timestamp\n"
-			else:
-				msg += "Applying date filter to Contact's LastContacted timestamp\n"
-				
-			print(msg)
-			print(msg_dates)
-			log.write(msg)
-			log.write(msg_dates)
-		except Exception as e:
+			result = run_filter(fromDate, toDate)
+		except IOError as e:
 			MessageBox.Show('Error: Unable to write to Log folder in default PA installation location!')
 			self.Close()
+			return False
 		
-		num_df_removed = 0
-		processPA_5_3 = False
-		processPA_5_4 = False
-		# check for version PA 5.3 which has access to ds.TaggedFiles
-		# or version of PA 5.4 which uses ds.DataFiles instead
-		try:
-			if ds.TaggedFiles is not None:
-				processPA_5_3 = True
-		except Exception as e:
-			if ds.DataFiles is not None:
-				processPA_5_4 = True
-		
-		if processPA_5_3 is True:
-			msg = "PA 5.3 processing"
-			print(msg)
-			log.write(msg)
-			num_df_removed = filter_DataFiles()
-		elif processPA_5_4 is True:
-			msg = "PA 5.4 processing"
-			print(msg)
-			log.write(msg)
-			num_df_removed = filter_DataFiles_v5_4()
-		else:
-			print "Unknown PA version"
-			log.write("Unknown PA version")
-				
-		num_ad_removed = filter_AnalyzedData2()
-		num_di_removed = filter_DeviceInfo()
-		total_removed = num_df_removed+num_ad_removed+num_di_removed
+		total_removed = result['removed']['Total']
+		duration = result['duration']
+		msg = 'Finished filtering Data Files and Analyzed Data\n\nFiltered out: '+str(total_removed)+"\nDuration: "+str(duration)
+		if result['root_hash'] is not None:
+			msg += "\n\nRemoval manifest root hash (SHA-256):\n"+result['root_hash']
+		MessageBox.Show(msg)
 		
-		proc_end = datetime.now()
-		duration = (proc_end - proc_start)
+		self.enableControls(True)
+		self.statusLabel.Text = 'Done processing.\nRemoved: '+str(total_removed)+"\nDuration: "+str(duration)
+		#self.Close()
+
+	def runBatch(self, sender, event):
+		dialog = OpenFileDialog()
+		dialog.Title = "Select batch manifest"
+		dialog.Filter = "Batch manifest (*.json)|*.json"
+		if dialog.ShowDialog() != DialogResult.OK:
+			return False
 		
-		MessageBox.Show('Finished filtering Data Files and Analyzed Data\n\nFiltered out: '+str(total_removed)+"\nDuration: "+str(duration))
+		self.enableControls(False)
+		self.statusLabel.Text = 'Processing batch... please wait.'
 		try:
-			log.write("\nRemoved: "+str(num_df_removed)+" Data Files." )
-			log.write("\nRemoved: "+str(num_ad_removed)+" Analyzed Data items.")
-			log.write("\nRemoved: "+str(num_di_removed)+" DeviceInfo items.")
-			log.write("\nRemoved: "+str(total_removed)+" Total items.")
-			t = proc_end
-			endtime = str(t.year)+"-"+str(t.month)+" "+str(t.day)+" "+str(t.hour)+":"+str(t.minute)+":"+str(t.second)
-			log.write("\nScript ended "+str(endtime)+"\n")
-			log.write("Daterange from: "+str(proc_start)+" - "+str(proc_end)+"\n")
-			log.write("Duration: "+str(duration)+"\n")
+			report = run_manifest(dialog.FileName)
 		except Exception as e:
-			errmsg = "Error at Processing ended. "+str(e)
-			print(errmsg)
-			debug(errmsg, "error closing log")
-		
-		self.check.Enabled = True
-		self.check2.Enabled = True
-		self.button0.Enabled = True
-		self.button1.Enabled = True
-		self.button2.Enabled = True
-		self.statusLabel.Text = 'Done processing.\nRemoved: '+str(total_removed)+"\nDuration: "+str(duration)
+			MessageBox.Show('Error: Unable to run batch manifest '+str(dialog.FileName)+"\n"+str(e))
+			self.enableControls(True)
+			self.statusLabel.Text = ''
+			return False
 		
-		log.close()
-		#self.Close()
+		done = [c for c in report['cases'] if c['status'] == 'done']
+		msg = 'Finished batch\n\nCases filtered: '+str(len(done))+' of '+str(len(report['cases']))
+		msg += '\nReport: '+report['report']
+		MessageBox.Show(msg)
+		self.enableControls(True)
+		self.statusLabel.Text = 'Done processing batch.\nCases filtered: '+str(len(done))
+
+	def previewRange(self, sender, event):
+		fromDate = self.fromTextBox.Text
+		toDate = self.toTextBox.Text
+		try:
+			start = System.Convert.ToDateTime(fromDate).ToUniversalTime().Ticks
+			end = System.Convert.ToDateTime(toDate).ToUniversalTime().Ticks
+		except Exception as e:
+			MessageBox.Show('Error: Unable to set start date '+str(fromDate)+"\n and end date "+str(toDate))
+			return False
+		if start > end:
+			MessageBox.Show("End time must be greater than start time.")
+			return False
+
+		if timeline is None:
+			self.enableControls(False)
+			self.statusLabel.Text = 'Building timeline... please wait.'
+			try:
+				build_timeline()
+			except IOError as e:
+				MessageBox.Show('Error: Unable to write to Log folder in default PA installation location!')
+				self.enableControls(True)
+				self.statusLabel.Text = ''
+				return False
+			self.enableControls(True)
+			self.statusLabel.Text = ''
+		MessageBox.Show('Preview\n\nStart: '+str(fromDate)+'\nEnd: '+str(toDate)+'\n\n'+timeline_summary(timeline_count(start, end)))
+
+	def undoFilter(self, sender, event):
+		msg = 'Restore the '+str(len(undo_journal))+' items removed or untagged by the last filter?'
+		if MessageBox.Show(msg, 'Undo last filter', MessageBoxButtons.YesNo) != DialogResult.Yes:
+			return False
+
+		self.enableControls(False)
+		self.statusLabel.Text = 'Restoring data... please wait.'
+		restored = undo_last_filter()
+		MessageBox.Show('Restored: '+str(restored))
+		self.enableControls(True)
+		self.statusLabel.Text = 'Done restoring.\nRestored: '+str(restored)
+
+	def enableControls(self, enabled):
+		self.check.Enabled = enabled
+		self.check2.Enabled = enabled
+		self.button0.Enabled = enabled
+		self.button1.Enabled = enabled
+		self.button2.Enabled = enabled
+		self.button3.Enabled = enabled
+		self.button4.Enabled = enabled and len(undo_journal) > 0
+		self.button5.Enabled = enabled
 		
 	def closeThis(self, sender, event):
 		self.fromTextBox.Text = ''
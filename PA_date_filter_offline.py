@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+# Offline date filter classifier for PA_date_filter timestamp snapshots.
+# Runs with a regular CPython 2.7 / 3.x, not inside Physical Analyzer.
+
+# PA_date_filter_20190221.py writes every timestamp it evaluates to
+# ./Logs/<log filename>.snapshot (plus a .json index with the category names
+# and the options used). This script re-classifies such a snapshot for any
+# date range without PA. The snapshot is split into item number ranges
+# that are classified by a pool of worker processes. Workers map the
+# snapshot file into memory, so it is shared through the OS page cache
+# instead of being pickled to every worker. Partitions never split an item
+# and are merged in order, so the result is identical to a serial run.
+
+# Usage:
+#   python PA_date_filter_offline.py case.snapshot
+#   python PA_date_filter_offline.py case.snapshot --start "2018-08-20 00:00:00-7" \
+#          --end "2019-02-20 23:59:59-8" --workers 8 --removed removed.txt
+#   python PA_date_filter_offline.py --synthetic 100000000 bench.snapshot
+#   python PA_date_filter_offline.py bench.snapshot --bench --workers 16
+
+import sys
+import os
+import re
+import json
+import mmap
+import struct
+import time
+import random
+import optparse
+import multiprocessing
+from array import array
+from datetime import datetime, timedelta
+
+# Must match the snapshot writer in PA_date_filter_20190221.py
+SNAPSHOT_MAGIC = b'PADFSNP1'
+SNAPSHOT_RECORD = struct.Struct('<IHBxq')
+SNAPSHOT_DELETED = 1
+SNAPSHOT_NONE = 2
+
+TICKS_PER_SECOND = 10000000
+DOTNET_EPOCH = datetime(1, 1, 1)
+
+# worker process state, set by open_snapshot()
+snapshot_file = None
+snapshot_map = None
+
+
+def toTicks(date_string):
+	''' UTC .NET ticks of 'yyyy-mm-dd hh:mm:ss[+-h]', the format used in the PA form
+	'''
+	m = re.match(r'^\s*(\d{4})-(\d{1,2})-(\d{1,2})[ T](\d{1,2}):(\d{2}):(\d{2})\s*([+-]\d{1,2})?\s*$', date_string)
+	if m is None:
+		raise ValueError("Unable to parse date "+date_string)
+	yyyy, mm, dd, hr, mn, sec, utc_offset = m.groups()
+	dt = datetime(int(yyyy), int(mm), int(dd), int(hr), int(mn), int(sec))
+	if utc_offset is not None:
+		dt -= timedelta(hours=int(utc_offset))
+	delta = dt - DOTNET_EPOCH
+	return (delta.days*86400 + delta.seconds)*TICKS_PER_SECOND
+
+
+def read_index(filename):
+	index = open(filename+'.json')
+	try:
+		return json.load(index)
+	finally:
+		index.close()
+
+
+def open_snapshot(filename):
+	global snapshot_file
+	global snapshot_map
+	snapshot_file = open(filename, 'rb')
+	snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+	if snapshot_map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+		raise ValueError(filename+" is not a PA date filter snapshot")
+
+
+def record_count():
+	return (len(snapshot_map) - len(SNAPSHOT_MAGIC)) // SNAPSHOT_RECORD.size
+
+
+def item_at(r):
+	return SNAPSHOT_RECORD.unpack_from(snapshot_map, len(SNAPSHOT_MAGIC) + r*SNAPSHOT_RECORD.size)[0]
+
+
+def partition(nparts):
+	''' Split the records into about nparts (first, last) ranges on item boundaries
+	'''
+	n = record_count()
+	bounds = [0]
+	for k in range(1, nparts):
+		r = max(bounds[-1], n*k // nparts)
+		while 0 < r < n and item_at(r) == item_at(r-1):
+			r += 1
+		if bounds[-1] < r < n:
+			bounds.append(r)
+	bounds.append(n)
+	return [(bounds[i], bounds[i+1]) for i in range(len(bounds)-1)]
+
+
+def iter_records(first, last):
+	offset = len(SNAPSHOT_MAGIC)
+	size = SNAPSHOT_RECORD.size
+	if hasattr(SNAPSHOT_RECORD, 'iter_unpack'):
+		view = memoryview(snapshot_map)[offset + first*size:offset + last*size]
+		try:
+			for record in SNAPSHOT_RECORD.iter_unpack(view):
+				yield record
+		finally:
+			view.release()
+	else:
+		unpack_from = SNAPSHOT_RECORD.unpack_from
+		for r in range(first, last):
+			yield unpack_from(snapshot_map, offset + r*size)
+
+
+def classify(job):
+	''' Classify records [first, last) the same way PA_date_filter does:
+	keep an item if it is deleted (and deleted items are not date filtered),
+	if it has no timestamps, or if any of its timestamps is within range.
+	Returns (removed item numbers, {category id: [kept, removed]})
+	'''
+	first, last, start_ticks, end_ticks, keep_deleted = job
+	removed = array('I')
+	counts = {}
+	item = category = None
+	keep = False
+
+	for num, cat, flags, ticks in iter_records(first, last):
+		if num != item:
+			if item is not None:
+				counts.setdefault(category, [0, 0])[not keep] += 1
+				if not keep:
+					removed.append(item)
+			item = num
+			category = cat
+			keep = False
+		if keep:
+			continue
+		if flags & SNAPSHOT_NONE:
+			keep = True
+		elif flags & SNAPSHOT_DELETED and keep_deleted:
+			keep = True
+		elif start_ticks <= ticks <= end_ticks:
+			keep = True
+	if item is not None:
+		counts.setdefault(category, [0, 0])[not keep] += 1
+		if not keep:
+			removed.append(item)
+	return removed, counts
+
+
+def merge(results):
+	''' Merge partial verdicts in partition order
+	'''
+	removed = array('I')
+	counts = {}
+	for part_removed, part_counts in results:
+		removed.extend(part_removed)
+		for cat, (kept, rem) in part_counts.items():
+			total = counts.setdefault(cat, [0, 0])
+			total[0] += kept
+			total[1] += rem
+	return removed, counts
+
+
+def run(filename, start_ticks, end_ticks, keep_deleted, workers):
+	jobs = [(first, last, start_ticks, end_ticks, keep_deleted) for first, last in partition(workers)]
+	if workers <= 1:
+		return merge([classify(job) for job in jobs])
+	pool = multiprocessing.Pool(workers, open_snapshot, (filename,))
+	try:
+		return merge(pool.map(classify, jobs, 1))
+	finally:
+		pool.close()
+		pool.join()
+
+
+def write_synthetic(filename, rows):
+	''' Random snapshot for benchmarking, 1 to 4 timestamps per item over 2000-2020
+	'''
+	lo = toTicks('2000-01-01 00:00:00')
+	hi = toTicks('2020-01-01 00:00:00')
+	categories = ['Synthetic.Category%d' % i for i in range(16)]
+	rng = random.Random(178)
+	out = open(filename, 'wb')
+	out.write(SNAPSHOT_MAGIC)
+	pack = SNAPSHOT_RECORD.pack
+	item = written = 0
+	chunk = []
+	while written < rows:
+		cat = rng.randrange(len(categories))
+		flags = 0
+		if rng.random() < 0.02:
+			flags |= SNAPSHOT_DELETED
+		if rng.random() < 0.05:
+			chunk.append(pack(item, cat, flags | SNAPSHOT_NONE, 0))
+			written += 1
+		else:
+			for i in range(min(rng.randint(1, 4), rows - written)):
+				chunk.append(pack(item, cat, flags, rng.randint(lo, hi)))
+				written += 1
+		item += 1
+		if len(chunk) >= 65536:
+			out.write(b''.join(chunk))
+			chunk = []
+	out.write(b''.join(chunk))
+	out.close()
+	index = open(filename+'.json', 'w')
+	json.dump({
+		'magic': SNAPSHOT_MAGIC.decode('ascii'),
+		'categories': categories,
+		'items': item,
+		'start_ticks': toTicks('2018-08-20 00:00:00-7'),
+		'end_ticks': toTicks('2019-02-20 23:59:59-8'),
+		'doNotDateFilterDeleted': True,
+		'doNotFilterContact_by_LastContacted': True,
+		}, index, indent=1)
+	index.close()
+
+
+def bench(filename, start_ticks, end_ticks, keep_deleted, max_workers):
+	print("Records: "+str(record_count()))
+	t0 = time.time()
+	serial = run(filename, start_ticks, end_ticks, keep_deleted, 1)
+	serial_time = time.time() - t0
+	print("workers\tseconds\tspeedup")
+	print("serial\t%.2f\t1.00" % serial_time)
+	workers = 2
+	while workers <= max_workers:
+		t0 = time.time()
+		result = run(filename, start_ticks, end_ticks, keep_deleted, workers)
+		elapsed = time.time() - t0
+		if result[0] != serial[0] or result[1] != serial[1]:
+			print("Mismatch with serial result at %d workers!" % workers)
+			return 1
+		print("%d\t%.2f\t%.2f" % (workers, elapsed, serial_time/elapsed))
+		workers *= 2
+	return 0
+
+
+def main(argv):
+	parser = optparse.OptionParser(usage="%prog [options] SNAPSHOT")
+	parser.add_option('--start', help="range start, default is the range of the PA run")
+	parser.add_option('--end', help="range end, default is the range of the PA run")
+	parser.add_option('--workers', type='int', default=multiprocessing.cpu_count())
+	parser.add_option('--filter-deleted', action='store_true', default=None,
+					help="apply the date range to deleted items")
+	parser.add_option('--removed', help="write removed item numbers to this file")
+	parser.add_option('--bench', action='store_true', help="time 1 to --workers processes")
+	parser.add_option('--synthetic', type='int', metavar='ROWS', help="write a random snapshot and exit")
+	options, args = parser.parse_args(argv)
+	if len(args) != 1:
+		parser.error("expected one snapshot file")
+	filename = args[0]
+
+	if options.synthetic:
+		write_synthetic(filename, options.synthetic)
+		return 0
+
+	index = read_index(filename)
+	for name in index.get('carried', []):
+		print("Warning: "+name+" was decided from an earlier snapshot and has no records in this one")
+	for name, count in sorted(index.get('skipped', {}).items()):
+		print("Warning: %d items of %s were kept without evaluating their timestamps and have no records" % (count, name))
+	start_ticks = index['start_ticks']
+	end_ticks = index['end_ticks']
+	if options.start:
+		start_ticks = toTicks(options.start)
+	if options.end:
+		end_ticks = toTicks(options.end)
+	keep_deleted = index['doNotDateFilterDeleted']
+	if options.filter_deleted:
+		keep_deleted = False
+
+	open_snapshot(filename)
+	if options.bench:
+		return bench(filename, start_ticks, end_ticks, keep_deleted, options.workers)
+
+	removed, counts = run(filename, start_ticks, end_ticks, keep_deleted, options.workers)
+	categories = index['categories']
+	for cat in sorted(counts):
+		kept, rem = counts[cat]
+		print("%s: kept %d removed %d" % (categories[cat], kept, rem))
+	print("Removed: %d of %d items" % (len(removed), index['items']))
+	if options.removed:
+		out = open(options.removed, 'w')
+		for item in removed:
+			out.write(str(item)+"\n")
+		out.close()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,707 @@
+# -*- coding: utf-8 -*-
+
+# Stand-in for Physical Analyzer to run PA_date_filter_20190221.py on a
+# synthetic datastore. Runs with a regular CPython 2.7, not inside Physical
+# Analyzer.
+
+# Installs stand-ins for the clr, System, System.Windows.Forms,
+# System.Drawing and physical modules, builds a datastore with random
+# timestamps and executes PA_date_filter_20190221.py on it:
+#   oracle  run_oracle() diffs filter_AnalyzedData() and
+#           filter_AnalyzedData2() item by item, nothing is removed
+#   filter  run_filter() twice on the same datastore, once with collections
+#           that have BeginUpdate/EndUpdate and once without, and counts the
+#           change notifications each one raised
+#   metadata  run_filter() on images whose only timestamp is a MetaData
+#           DateTime with fractional seconds or 'Z', and checks each verdict
+#   batch   run_manifest() on a manifest of cases on several datastores,
+#           opened through its openCase hook, and checks the status of each
+# The datastore has every model type filter_AnalyzedData() handles, chats
+# with instant messages, Data Files and DeviceInfo entries. About 5% of the
+# items are deleted and 15% of the timestamps are missing. The messages of
+# a chat are within 30 days of each other, but 5% of their timestamps are
+# anywhere, and a chat's StartTime and LastActivity are the first and last
+# TimeStamp of its messages. The same seed gives the same datastore. Logs are written to ./Logs as in PA.
+# Only what PA_date_filter_20190221.py uses is stood in for: time zones are
+# UTC offsets, Windows time zone ids are not known, and there are no
+# file contents to read EXIF or container timestamps from.
+
+# Usage:
+#   python PA_date_filter_standin.py oracle --items 100000
+#   python PA_date_filter_standin.py filter --items 10000 --seed 7 \
+#          --start "2018-08-20 00:00:00-7" --end "2019-02-20 23:59:59-8"
+#   python PA_date_filter_standin.py metadata
+#   python PA_date_filter_standin.py batch --items 2000
+
+import sys
+import os
+import re
+import imp
+import json
+import random
+import optparse
+from datetime import datetime, timedelta
+
+FILTER_SCRIPT = 'PA_date_filter_20190221.py'
+
+DOTNET_EPOCH = datetime(1, 1, 1)
+TICKS_PER_SECOND = 10000000
+DATE = re.compile(r'^\s*(\d{4})-(\d{1,2})-(\d{1,2})[ T](\d{1,2}):(\d\d):(\d\d)\s*(?:([+-]\d{1,2})(?::?(\d\d))?)?\s*$')
+
+# Model types of filter_AnalyzedData() and their timestamp fields
+LEGACY_TYPES = [
+	('Data.Models.ContactModels.Contact', ['TimeContacted', 'TimeCreated', 'TimeModified']),
+	('Data.Models.User', ['TimeCreated', 'TimeLastLoggedIn']),
+	('Data.Models.Party', ['DateDelivered', 'DateRead', 'DatePlayed']),
+	('Data.Models.SMS', ['TimeStamp']),
+	('Data.Models.TelephonyModels.Call', ['TimeStamp']),
+	('Data.Models.Email', ['TimeStamp']),
+	('Data.Models.MMS', ['TimeStamp']),
+	('Data.Models.MailMessage', ['TimeStamp']),
+	('Data.Models.InstantMessage', ['TimeStamp', 'DateRead', 'DateDelivered']),
+	('Data.Models.Note', ['Creation', 'Modification']),
+	('Data.Models.CalendarEntry', ['StartDate', 'EndDate', 'Reminder', 'RepeatUntil']),
+	('Data.Models.LocationModels.Location', ['TimeStamp']),
+	('Data.Models.LocationModels.Journey', ['StartTime', 'EndTime']),
+	('Data.Models.Cookie', ['Expiry', 'CreationTime', 'LastAccessTime']),
+	('Data.Models.VisitedPage', ['LastVisited']),
+	('Data.Models.WebBookmark', ['LastVisited', 'TimeStamp']),
+	('Data.Models.BluetoothDevice', ['LastConnected']),
+	('Data.Models.WirelessNetwork', ['LastConnection', 'LastAutoConnection']),
+	('Data.Models.TelephonyModels.Voicemail', ['TimeStamp', 'Duration']),
+	('Data.Models.ApplicationModels.InstalledApplication', ['PurchaseDate', 'DeletedDate']),
+	('Data.Models.ApplicationModels.ApplicationUsage', ['ActiveTime', 'Date', 'LastLaunch']),
+	('Data.Models.SharedFile', ['TimeStamp']),
+	('Data.Models.SearchedItem', ['TimeStamp']),
+	('Data.Models.PoweringEvent', ['TimeStamp']),
+	('Data.Models.MobileCard', ['PurchaseTime', 'ModifyTime', 'ActivationTime', 'ExpirationTime']),
+	('Data.Models.IPConnection', ['TimeStamp']),
+	('Data.Models.LogEntry', ['TimeStamp']),
+	]
+CHAT_TYPE = 'Data.Models.Chat'
+CHAT_FIELDS = ['StartTime', 'LastActivity']
+MESSAGE_TYPE = 'Data.Models.InstantMessage'
+MESSAGE_FIELDS = ['TimeStamp', 'DateRead', 'DateDelivered']
+# fields that are not timestamps
+NONE_FIELDS = set(['Duration', 'ActiveTime'])
+
+DATAFILE_CATEGORIES = [
+	('Image', '.jpg'),
+	('Audio', '.mp3'),
+	('Text', '.txt'),
+	('Database', '.db'),
+	]
+
+# MetaData DateTime of an image and whether it is kept in METADATA_RANGE
+METADATA_RANGE = ("2018-08-20 00:00:00-7", "2019-02-20 23:59:59-8")
+METADATA_CASES = [
+	('2018-10-01T12:00:00.5+02:00', True),
+	('2010-10-01T12:00:00.5+02:00', False),
+	('2018-08-20T08:30:00.5+02:00', False),
+	('2018-08-20T09:00:00.25+02:00', True),
+	('2018-10-01T12:00:00Z', True),
+	('2010-10-01T12:00:00Z', False),
+	('2018-08-20T06:59:59Z', False),
+	('2018-08-20T07:00:00Z', True),
+	]
+
+# change notifications raised by the collections of the datastore
+notifications = {'changes': 0, 'refreshes': 0}
+
+
+# System
+class TimeSpan(object):
+	def __init__(self, ticks):
+		self.Ticks = ticks
+
+
+class DateTimeKind(object):
+	Unspecified = 0
+	Utc = 1
+	Local = 2
+
+
+class DateTime(object):
+	''' Local ticks and their UTC offset in ticks
+	'''
+	def __init__(self, ticks, kind=DateTimeKind.Unspecified, offset=0):
+		self.Ticks = ticks
+		self.Kind = kind
+		self.offset = offset
+
+	def ToUniversalTime(self):
+		return DateTime(self.Ticks - self.offset, DateTimeKind.Utc)
+
+	def __str__(self):
+		d = DOTNET_EPOCH + timedelta(microseconds=self.Ticks//10)
+		return d.strftime('%m/%d/%Y %I:%M:%S %p')
+
+
+class Convert(object):
+	@staticmethod
+	def ToDateTime(s):
+		m = DATE.match(str(s))
+		if m is None:
+			raise ValueError("String was not recognized as a valid DateTime: "+str(s))
+		yyyy, mm, dd, hr, mn, sec, hours, minutes = m.groups()
+		d = datetime(int(yyyy), int(mm), int(dd), int(hr), int(mn), int(sec)) - DOTNET_EPOCH
+		offset = 0
+		if hours is not None:
+			offset = (abs(int(hours))*60 + int(minutes or 0))*60*TICKS_PER_SECOND
+			if hours.startswith('-'):
+				offset = -offset
+		return DateTime((d.days*86400 + d.seconds)*TICKS_PER_SECOND, DateTimeKind.Local, offset)
+
+
+class UtcTimeZone(object):
+	def GetUtcOffset(self, dt):
+		return TimeSpan(0)
+
+
+class TimeZoneInfo(object):
+	Local = UtcTimeZone()
+
+	@staticmethod
+	def FindSystemTimeZoneById(name):
+		raise KeyError("The time zone ID '"+str(name)+"' was not found in the stand-in")
+
+
+# System.Windows.Forms, System.Drawing
+class Handler(object):
+	''' Any event, method or child of a control: accepts handlers, calls and members
+	'''
+	def __iadd__(self, handler):
+		return self
+
+	def __call__(self, *args):
+		return None
+
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		return Handler()
+
+
+class Control(object):
+	def __init__(self, *args):
+		self.Text = ''
+		self.Checked = False
+		self.Enabled = True
+
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		value = Handler()
+		setattr(self, name, value)
+		return value
+
+
+class DialogResult(object):
+	OK = 1
+	Cancel = 2
+	Yes = 6
+	No = 7
+
+
+class MessageBoxButtons(object):
+	OK = 0
+	YesNo = 4
+
+
+class MessageBox(object):
+	@staticmethod
+	def Show(text, *args):
+		print("MessageBox: "+str(text))
+		return DialogResult.Yes
+
+
+def Point(x, y):
+	return (x, y)
+
+
+# physical
+class TimeStamp(object):
+	def __init__(self, value, is_utc=False):
+		self.Value = value
+
+	def __cmp__(self, other):
+		if other is None:
+			return 1
+		return cmp(self.Value.ToUniversalTime().Ticks, other.Value.ToUniversalTime().Ticks)
+
+	def __str__(self):
+		return str(self.Value)
+
+
+class Field(object):
+	def __init__(self, value):
+		self.Value = value
+
+	def __str__(self):
+		return str(self.Value)
+
+
+class Collection(list):
+	''' Model collection, Tags or DeviceInfo. Every change raises a notification.
+	'''
+	def Remove(self, item):
+		list.remove(self, item)
+		notifications['changes'] += 1
+
+	def Insert(self, position, item):
+		list.insert(self, position, item)
+		notifications['changes'] += 1
+
+	def Add(self, item):
+		self.append(item)
+		notifications['changes'] += 1
+
+	def Clear(self):
+		del self[:]
+		notifications['changes'] += 1
+
+	def IndexOf(self, item):
+		return self.index(item)
+
+
+class BulkCollection(Collection):
+	''' Collection with a bulk update scope: changes between BeginUpdate() and
+	EndUpdate() raise a single refresh
+	'''
+	updating = False
+	changed = False
+
+	def BeginUpdate(self):
+		self.updating = True
+		self.changed = False
+
+	def EndUpdate(self):
+		self.updating = False
+		if self.changed:
+			notifications['refreshes'] += 1
+
+	def Remove(self, item):
+		list.remove(self, item)
+		self.notify()
+
+	def Insert(self, position, item):
+		list.insert(self, position, item)
+		self.notify()
+
+	def Add(self, item):
+		self.append(item)
+		self.notify()
+
+	def Clear(self):
+		del self[:]
+		self.notify()
+
+	def notify(self):
+		if self.updating:
+			self.changed = True
+		else:
+			notifications['changes'] += 1
+
+
+class Model(object):
+	def __init__(self, model_type, fields, deleted, collection):
+		self.ModelType = model_type
+		self.Deleted = deleted
+		self.ModelCollection = collection
+		self.fields = fields
+
+	def FieldExists(self, name):
+		return name in self.fields
+
+	def __getattr__(self, name):
+		if name.startswith('__') or name == 'fields':
+			raise AttributeError(name)
+		try:
+			value = self.fields[name]
+		except KeyError:
+			raise AttributeError("'"+self.ModelType+"' object has no attribute '"+name+"'")
+		if name in ('Messages', 'AllTimeStamps'):
+			return value
+		return Field(value)
+
+
+class DataFile(object):
+	def __init__(self, name, path, deleted, times, tags):
+		self.Name = name
+		self.AbsolutePath = path
+		self.Deleted = deleted
+		self.CreationTime, self.ModifyTime, self.AccessTime, self.DeletedTime = times
+		self.MetaData = None
+		self.Tags = tags
+
+
+class MetaDataEntry(object):
+	def __init__(self, name, value):
+		self.Name = name
+		self.Value = value
+
+
+class DeviceInfoEntry(object):
+	def __init__(self, name, value):
+		self.Name = name
+		self.Value = value
+
+
+class DeviceInfo(Collection):
+	def __getitem__(self, key):
+		if isinstance(key, basestring):
+			for i in self:
+				if i.Name == key:
+					return i.Value
+			return None
+		return list.__getitem__(self, key)
+
+
+class BulkDeviceInfo(BulkCollection, DeviceInfo):
+	pass
+
+
+class UnreadableDeviceInfo(DeviceInfo):
+	''' DeviceInfo of an extraction that fails once filtering has started:
+	its Display Name can be read, but not its entries
+	'''
+	def __getitem__(self, key):
+		if isinstance(key, basestring):
+			for i in list.__iter__(self):
+				if i.Name == key:
+					return i.Value
+			return None
+		return list.__getitem__(self, key)
+
+	def __iter__(self):
+		raise IOError("extraction is not readable")
+
+
+class ModelTypeEntry(object):
+	def __init__(self, model_type):
+		self.ModelType = model_type
+
+
+class Models(object):
+	def __init__(self, collections):
+		self.collections = collections
+
+	def __iter__(self):
+		return iter([ModelTypeEntry(t) for t in sorted(self.collections)])
+
+	def __getitem__(self, model_type):
+		return self.collections[model_type]
+
+
+class DataFileCategory(object):
+	def __init__(self, key):
+		self.Key = key
+
+
+class DataFiles(object):
+	def __init__(self, categories):
+		self.categories = categories
+
+	def __iter__(self):
+		return iter([DataFileCategory(k) for k in sorted(self.categories)])
+
+	def __getitem__(self, key):
+		return self.categories[key]
+
+
+class DataStore(object):
+	def __init__(self, models, files, device_info):
+		self.Models = Models(models)
+		self.DataFiles = DataFiles(files)
+		self.DeviceInfo = device_info
+
+
+class Namespace(object):
+	pass
+
+
+def data_namespace():
+	''' Data.Models.<type> as the type name, as model types compare in the filter
+	'''
+	data = Namespace()
+	data.Models = Namespace()
+	for name in [t for t, fields in LEGACY_TYPES] + [CHAT_TYPE]:
+		parent = data
+		parts = name.split('.')
+		for part in parts[1:-1]:
+			if not hasattr(parent, part):
+				setattr(parent, part, Namespace())
+			parent = getattr(parent, part)
+		setattr(parent, parts[-1], name)
+	return data
+
+
+def synthetic_datastore(items, seed, bulk):
+	''' About items model items, a quarter of them instant messages in chats,
+	plus items/10 Data Files
+	'''
+	rng = random.Random(seed)
+	lo = (datetime(2000, 1, 1) - DOTNET_EPOCH).days*86400
+	hi = (datetime(2020, 1, 1) - DOTNET_EPOCH).days*86400
+	collection_type = Collection
+	device_info_type = DeviceInfo
+	if bulk:
+		collection_type = BulkCollection
+		device_info_type = BulkDeviceInfo
+
+	def timestamp(base=None):
+		if rng.random() < 0.15:
+			return None
+		offset = rng.choice([-8, -7, 0, 1, 2])*3600*TICKS_PER_SECOND
+		if base is None or rng.random() < 0.05:
+			seconds = rng.randint(lo, hi)
+		else:
+			seconds = base + rng.randint(0, 30*86400)
+		return TimeStamp(DateTime(seconds*TICKS_PER_SECOND, DateTimeKind.Local, offset), True)
+
+	def deleted():
+		if rng.random() < 0.05:
+			return 'Deleted'
+		return 'Intact'
+
+	def model(model_type, names, collection, base=None):
+		fields = {}
+		for name in names:
+			if name in NONE_FIELDS:
+				fields[name] = None
+			else:
+				fields[name] = timestamp(base)
+		return Model(model_type, fields, deleted(), collection)
+
+	models = {}
+	per_type = max(1, items*3//4//len(LEGACY_TYPES))
+	for model_type, names in LEGACY_TYPES:
+		collection = models[model_type] = collection_type()
+		for n in range(per_type):
+			f = model(model_type, names, collection)
+			if model_type == 'Data.Models.ContactModels.Contact':
+				f.fields['Name'] = 'Contact %d' % n
+			elif model_type == 'Data.Models.SMS':
+				f.fields['AllTimeStamps'] = []
+				if rng.random() < 0.1:
+					f.fields['AllTimeStamps'] = [Field(Field(ts)) for ts in [timestamp(), timestamp()] if ts is not None]
+			collection.append(f)
+
+	chats = models[CHAT_TYPE] = collection_type()
+	left = max(1, items//4)
+	while left > 0:
+		chat = model(CHAT_TYPE, CHAT_FIELDS, chats)
+		messages = collection_type()
+		base = rng.randint(lo, hi)
+		for n in range(min(left, rng.randint(1, 40))):
+			messages.append(model(MESSAGE_TYPE, MESSAGE_FIELDS, messages, base))
+		left -= len(messages)
+		chat.fields['Messages'] = messages
+		# as in PA, the chat spans the TimeStamps of its messages
+		times = [im.fields['TimeStamp'] for im in messages if im.fields['TimeStamp'] is not None]
+		chat.fields['StartTime'] = times and min(times) or None
+		chat.fields['LastActivity'] = times and max(times) or None
+		chats.append(chat)
+
+	files = {}
+	for n in range(max(1, items//10)):
+		category, extension = DATAFILE_CATEGORIES[n % len(DATAFILE_CATEGORIES)]
+		name = 'file%d%s' % (n, extension)
+		times = [timestamp(), timestamp(), timestamp(), None]
+		state = deleted()
+		if state == 'Deleted':
+			times[3] = timestamp()
+		f = DataFile(name, '/data/'+category.lower()+'/'+name, state, times, collection_type(['Tagged']))
+		files.setdefault('Data.Files.'+category, []).append(f)
+
+	device_info = device_info_type([DeviceInfoEntry('Display Name', 'Synthetic %d' % seed)])
+	for n in range(max(1, items//100)):
+		d = DOTNET_EPOCH + timedelta(seconds=rng.randint(lo, hi))
+		device_info.append(DeviceInfoEntry('DeviceInfoLocalNetworkIP', '10.0.%d.%d at %s' % (n//250, n%250+1, d.strftime('%Y-%m-%d %H:%M:%S'))))
+	return DataStore(models, files, device_info)
+
+
+def install(datastore):
+	''' Puts the stand-in modules in sys.modules, with datastore as physical.ds
+	'''
+	system = imp.new_module('System')
+	for name, value in [('Convert', Convert), ('DateTime', DateTime), ('DateTimeKind', DateTimeKind),
+						('TimeSpan', TimeSpan), ('TimeZoneInfo', TimeZoneInfo)]:
+		setattr(system, name, value)
+	forms = imp.new_module('System.Windows.Forms')
+	for name in ['Application', 'Button', 'Form', 'Label', 'TextBox', 'CheckBox', 'OpenFileDialog']:
+		setattr(forms, name, Control)
+	forms.MessageBox = MessageBox
+	forms.DialogResult = DialogResult
+	forms.MessageBoxButtons = MessageBoxButtons
+	windows = imp.new_module('System.Windows')
+	windows.Forms = forms
+	system.Windows = windows
+	drawing = imp.new_module('System.Drawing')
+	drawing.Point = Point
+	system.Drawing = drawing
+	clr = imp.new_module('clr')
+	clr.AddReference = lambda name: None
+	physical = imp.new_module('physical')
+	physical.System = system
+	physical.TimeStamp = TimeStamp
+	physical.Data = data_namespace()
+	physical.ds = datastore
+	sys.modules.update({
+		'System': system,
+		'System.Windows': windows,
+		'System.Windows.Forms': forms,
+		'System.Drawing': drawing,
+		'clr': clr,
+		'physical': physical,
+		})
+
+
+def load_filter(script, datastore):
+	''' Executes the filter script in a new namespace on datastore
+	'''
+	install(datastore)
+	namespace = {'__name__': 'PA_date_filter', '__file__': script}
+	source = open(script).read()
+	exec(compile(source, script, 'exec'), namespace)
+	return namespace
+
+
+def count_models(datastore):
+	n = 0
+	for m in datastore.Models:
+		for f in datastore.Models[m.ModelType]:
+			n += 1
+			if f.FieldExists('Messages'):
+				n += len(f.Messages)
+	return n
+
+
+def run_oracle(script, options):
+	datastore = synthetic_datastore(options.items, options.seed, True)
+	print("Synthetic datastore: %d model items, seed %d" % (count_models(datastore), options.seed))
+	pa_filter = load_filter(script, datastore)
+	report = pa_filter['run_oracle'](options.start, options.end)
+	if len(report['mismatches']) > 0:
+		return 1
+	return 0
+
+
+def run_filter(script, options):
+	results = []
+	for bulk in [False, True]:
+		notifications['changes'] = notifications['refreshes'] = 0
+		datastore = synthetic_datastore(options.items, options.seed, bulk)
+		pa_filter = load_filter(script, datastore)
+		# both runs classify the datastore, the second does not reuse the first
+		for option in ['useVerdictCache', 'usePreviousSnapshot', 'resumeFromCheckpoint']:
+			pa_filter[option] = False
+		before = count_models(datastore)
+		pa_filter['run_filter'](options.start, options.end)
+		removed = before - count_models(datastore)
+		results.append((bulk, removed, notifications['changes'], notifications['refreshes']))
+	print("bulk update\tremoved models\tnotifications\trefreshes")
+	for bulk, removed, changes, refreshes in results:
+		print("%s\t%d\t%d\t%d" % (bulk and 'yes' or 'no', removed, changes, refreshes))
+	if results[0][1] != results[1][1]:
+		print("Mismatch: the bulk update changed what was removed!")
+		return 1
+	return 0
+
+
+def run_metadata(script, options):
+	files = []
+	for n, (value, kept) in enumerate(METADATA_CASES):
+		f = DataFile('metadata%d.jpg' % n, '/data/image/metadata%d.jpg' % n, 'Intact', [None]*4, Collection(['Tagged']))
+		f.MetaData = [MetaDataEntry('DateTime', value)]
+		files.append(f)
+	datastore = DataStore({}, {'Data.Files.Image': files}, DeviceInfo([DeviceInfoEntry('Display Name', 'MetaData')]))
+	pa_filter = load_filter(script, datastore)
+	for option in ['useVerdictCache', 'usePreviousSnapshot', 'resumeFromCheckpoint']:
+		pa_filter[option] = False
+	pa_filter['run_filter'](*METADATA_RANGE)
+	failed = 0
+	for f, (value, kept) in zip(files, METADATA_CASES):
+		result = 'ok'
+		if (len(f.Tags) > 0) != kept:
+			result = 'FAILED'
+			failed += 1
+		print("%s\t%s\t%s" % (value, kept and 'kept' or 'removed', result))
+	return failed and 1 or 0
+
+
+def run_batch(script, options):
+	datastores = {}
+	for seed in [options.seed, options.seed+1]:
+		datastore = synthetic_datastore(options.items, seed, True)
+		datastores['Synthetic %d' % seed] = datastore
+	broken = synthetic_datastore(options.items//10, options.seed+2, True)
+	broken.DeviceInfo = UnreadableDeviceInfo([DeviceInfoEntry('Display Name', 'Unreadable')])
+	datastores['Unreadable'] = broken
+	first, second = ['Synthetic %d' % seed for seed in [options.seed, options.seed+1]]
+	# (case, expected status)
+	cases = [
+		({'name': 'first', 'device': first, 'from': options.start, 'to': options.end}, 'done'),
+		({'name': 'second', 'device': second, 'from': options.start, 'to': options.end}, 'done'),
+		({'name': 'first again', 'device': first, 'from': options.start, 'to': options.end}, 'skipped: datastore already filtered'),
+		({'name': 'no end', 'device': second, 'from': options.start}, "error: case has no 'to' date"),
+		({'name': 'unreadable', 'device': 'Unreadable', 'from': options.start, 'to': options.end}, 'error: extraction is not readable'),
+		({'name': 'not open', 'device': 'Elsewhere', 'from': options.start, 'to': options.end}, 'skipped: extraction is not open'),
+		('not a case', 'error: case is not an object'),
+		]
+	manifest_filename = './Logs/PA_date_filter_standin_manifest.json'
+	manifest_file = open(manifest_filename, 'w')
+	try:
+		json.dump({'report': './Logs/PA_date_filter_standin_batch_report.json',
+			'cases': [case for case, expected in cases]}, manifest_file, indent=1)
+	finally:
+		manifest_file.close()
+
+	pa_filter = load_filter(script, datastores[first])
+	for option in ['useVerdictCache', 'usePreviousSnapshot', 'resumeFromCheckpoint']:
+		pa_filter[option] = False
+	def open_case(case):
+		return datastores.get(case.get('device', ''))
+	report = pa_filter['run_manifest'](manifest_filename, open_case)
+
+	# run_manifest() sorts the cases by device, keeping their order within one
+	expected = dict([(isinstance(case, dict) and case['name'] or '', status) for case, status in cases])
+	failed = 0
+	for entry in report['cases']:
+		result = 'ok'
+		if not entry['status'].startswith(expected[entry['name']]):
+			result = 'FAILED'
+			failed += 1
+		print("%s\t%s\t%s" % (entry['name'] or '-', entry['status'], result))
+	# the unreadable case raised in run_filter() after its log and audit were opened
+	if pa_filter['audit'] is not None or not pa_filter['log'].out.closed:
+		print("FAILED: the log or audit of the failed run was left open")
+		failed += 1
+	return failed and 1 or 0
+
+
+MODES = {
+	'oracle': run_oracle,
+	'filter': run_filter,
+	'metadata': run_metadata,
+	'batch': run_batch,
+	}
+
+def main(argv):
+	parser = optparse.OptionParser(usage="%prog [options] "+"|".join(sorted(MODES)))
+	parser.add_option('--items', type='int', default=10000, help="model items of the synthetic datastore")
+	parser.add_option('--seed', type='int', default=178)
+	parser.add_option('--start', default="2018-08-20 00:00:00-7")
+	parser.add_option('--end', default="2019-02-20 23:59:59-8")
+	parser.add_option('--script', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), FILTER_SCRIPT),
+					help="filter script to run, default is "+FILTER_SCRIPT+" next to this one")
+	options, args = parser.parse_args(argv)
+	if len(args) != 1 or args[0] not in MODES:
+		parser.error("expected one of "+", ".join(sorted(MODES)))
+	if not os.path.isdir('./Logs'):
+		os.mkdir('./Logs')
+	return MODES[args[0]](options.script, options)
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
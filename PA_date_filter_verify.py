@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# Verifier for PA_date_filter removal manifests.
+# Runs with a regular CPython 2.7 / 3.x, not inside Physical Analyzer.
+
+# PA_date_filter_20190221.py lists the items it removed in
+# ./Logs/<log filename>.removed.txt as a hash chain: item lines in blocks,
+# each block followed by a seal line '#<sha256 hex>' that is the SHA-256 of
+# the previous seal's hex digest and the block's item lines. The first block
+# is chained to the SHA-256 of the header line. The last seal is the root
+# hash shown by PA_date_filter when the run finished.
+# This script recomputes the chain in one pass over the file.
+
+# Usage:
+#   python PA_date_filter_verify.py case.removed.txt
+#   python PA_date_filter_verify.py case.removed.txt --root <root hash>
+
+import sys
+import hashlib
+import optparse
+
+# Must match the manifest writer in PA_date_filter_20190221.py
+REMOVAL_MANIFEST_MAGIC = b'PADFRMV1'
+
+
+def verify(filename):
+	''' Returns (root hash, items, blocks). Raises ValueError at the first broken seal
+	'''
+	manifest = open(filename, 'rb')
+	try:
+		header = manifest.readline()
+		if not header.startswith(REMOVAL_MANIFEST_MAGIC):
+			raise ValueError(filename+" is not a PA date filter removal manifest")
+		digest = hashlib.sha256(header.rstrip(b'\n')).hexdigest()
+		block = hashlib.sha256(digest.encode('ascii'))
+		items = blocks = pending = 0
+		lineno = 1
+		for line in manifest:
+			lineno += 1
+			if line.startswith(b'#'):
+				digest = block.hexdigest()
+				if line.rstrip(b'\r\n') != b'#'+digest.encode('ascii'):
+					raise ValueError("Seal of block %d at line %d does not match its items" % (blocks+1, lineno))
+				blocks += 1
+				pending = 0
+				block = hashlib.sha256(digest.encode('ascii'))
+			else:
+				block.update(line)
+				items += 1
+				pending += 1
+		if blocks == 0:
+			raise ValueError("No seal found")
+		if pending > 0:
+			raise ValueError("Items after the last seal at line %d" % lineno)
+		return digest, items, blocks
+	finally:
+		manifest.close()
+
+
+def main(argv):
+	parser = optparse.OptionParser(usage="%prog [options] MANIFEST")
+	parser.add_option('--root', help="expected root hash, as shown by PA_date_filter")
+	options, args = parser.parse_args(argv)
+	if len(args) != 1:
+		parser.error("expected one manifest file")
+
+	try:
+		root, items, blocks = verify(args[0])
+	except ValueError as e:
+		print("FAILED: "+str(e))
+		return 1
+	print("Items: %d in %d blocks" % (items, blocks))
+	print("Root hash: "+root)
+	if options.root and options.root.strip().lower() != root:
+		print("FAILED: root hash does not match "+options.root)
+		return 1
+	print("OK")
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))